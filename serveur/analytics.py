@@ -0,0 +1,56 @@
+# Agrégats d'activité par heure et par jour (heure locale), pour les cartes de
+# chaleur de /admin.
+#
+# Les compteurs sont tenus à jour à l'ingestion dans une petite table de
+# cumuls (event_rollup) : les questions « à quelle heure sonne-t-on ? » ou
+# « quand y a-t-il du bruit suspect ? » se lisent sur quelques centaines de
+# lignes au lieu de parcourir les événements bruts. Ce module ne fait que les
+# calculs ; le modèle et les requêtes sont dans app.py.
+
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+HOUR = "hour"
+DAY = "day"
+WEEKDAYS = ("Lun", "Mar", "Mer", "Jeu", "Ven", "Sam", "Dim")
+
+
+def local_buckets(ts, tz):
+    """Clés (heure, jour) locales d'un horodatage UTC naïf : "YYYY-MM-DD HH", "YYYY-MM-DD"."""
+    local = ts.replace(tzinfo=timezone.utc).astimezone(tz)
+    return local.strftime("%Y-%m-%d %H"), local.strftime("%Y-%m-%d")
+
+
+def rollup_counts(events, tz):
+    """Compte des événements [(type, timestamp)] par (période, case, type)."""
+    counts = Counter()
+    for evt_type, ts in events:
+        hour, day = local_buckets(ts, tz)
+        counts[(HOUR, hour, evt_type)] += 1
+        counts[(DAY, day, evt_type)] += 1
+    return counts
+
+
+def first_bucket(days, tz, now=None):
+    """Jour local (clé "YYYY-MM-DD") qui ouvre une fenêtre des `days` derniers jours, aujourd'hui compris."""
+    today = (now or datetime.now(timezone.utc)).astimezone(tz).date()
+    return (today - timedelta(days=days - 1)).isoformat()
+
+
+def heatmap(hour_rows):
+    """Matrice 7 x 24 (lundi en premier) à partir des cases horaires [(case, nombre)]."""
+    grid = [[0] * 24 for _ in WEEKDAYS]
+    for bucket, count in hour_rows:
+        dt = datetime.strptime(bucket, "%Y-%m-%d %H")
+        grid[dt.weekday()][dt.hour] += count
+    return grid
+
+
+def daily_series(day_rows, start, days):
+    """Série jour par jour [(jour, nombre)] sur `days` jours à partir de `start`, jours vides à 0."""
+    counts = Counter()
+    for bucket, count in day_rows:
+        counts[bucket] += count
+    first = datetime.strptime(start, "%Y-%m-%d").date()
+    return [((first + timedelta(days=i)).isoformat(), counts[(first + timedelta(days=i)).isoformat()])
+            for i in range(days)]
@@ -1,17 +1,40 @@
-from flask import Flask, request, jsonify, render_template, redirect, url_for, Response, stream_with_context, session, flash
+from flask import Flask, abort, g, request, jsonify, render_template, redirect, url_for, Response, stream_with_context, session, flash
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import func, inspect, literal, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
 from werkzeug.security import check_password_hash
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
+import click
 import pytz
 import os
 import time
 import json
+import math
+import base64
+import hmac
+import secrets
 from functools import wraps
-from pywebpush import webpush, WebPushException
+import analytics
+from broker import EventBroker, SnapshotCache
+from datagram import CREATED, DUPLICATE, RATE_LIMITED, REJECTED, DatagramListener
+from devices import DeviceKeys
+from metrics import Counter, Gauge, Histogram, Registry
+from push import PushDispatcher, PushSender
+from ratelimit import NotificationCoalescer, RateLimiter
+from storage import WriteBatcher, install_pragmas, sqlite_engine_options
+
+# Réglages SQLite (WAL, pool, écrivain unique) ; SONNETTE_DB_TUNING=0 revient
+# au comportement par défaut, pour comparaison (bench/ingest_sqlite.py)
+DB_TUNING = os.environ.get("SONNETTE_DB_TUNING", "1") != "0"
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 10))  # [connexions] Gardées ouvertes par processus gunicorn
+DB_WRITE_BATCH = 200      # [requêtes] Max regroupées dans une transaction par l'écrivain
 
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///sonnette.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get("DATABASE_URL", 'sqlite:///sonnette.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+if DB_TUNING:
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = sqlite_engine_options(pool_size=DB_POOL_SIZE, max_overflow=2 * DB_POOL_SIZE)
 app.secret_key = os.environ.get("FLASK_SECRET", "changemeplz")
 SECRET_KEY = os.environ.get("SONNETTE_SECRET", "super_secret")
 
@@ -19,8 +42,62 @@ VAPID_PRIVATE_KEY = "4QDH4NRlxvtLVaMcPQkChf80j1DP5TPqV9JUTgsLPFc"
 VAPID_PUBLIC_KEY  = "BA89zCzXgx5Ulz-p4_IyEMsbzofxWv7d1px-5648i9UCXj57vGnv_DmLYKdQ1JmxG5eRYN5Pp1czQbjOA66Z6Hg"
 VAPID_CLAIMS = {"sub": "mailto:thomas.jeanjacquot@telecomnancy.net"}
 
+STREAM_HEARTBEAT = 15     # [secondes] Commentaire SSE envoyé aux connexions inactives
+STREAM_QUEUE_SIZE = 100   # [messages] Taille max de la file d'un client /stream avant déconnexion
+PUSH_WORKERS = int(os.environ.get("PUSH_WORKERS", 4))  # [threads] Envois Web Push simultanés
+PUSH_MAX_RETRIES = 3      # [nombre] Nouvelles tentatives sur erreur transitoire (réseau, 429, 5xx)
+PUSH_TIMEOUT = 10         # [secondes] Timeout d'un envoi vers le service push
+INGEST_RATE = 0.2         # [requêtes/s] Débit soutenu accepté par sonnette et par type d'événement
+INGEST_BURST = 10         # [requêtes] Rafale acceptée avant limitation (429)
+BATCH_EVENTS_PER_TOKEN = 50  # [nombre] Un lot coûte un jeton par tranche de ce nombre d'événements d'un même type
+NOTIF_COALESCE_WINDOW = 30  # [secondes] Notifications d'un même type et d'une même sonnette regroupées sur cette fenêtre
+BATCH_MAX_EVENTS = 500    # [nombre] Taille max d'un lot envoyé sur /api/sonnette/batch
+TELEMETRY_MAX_BYTES = 16384  # [octets] Taille max d'un résumé de télémétrie envoyé sur /api/telemetry
+TELEMETRY_RETENTION_DAYS = 30  # [jours] Résumés de télémétrie conservés par sonnette
+UDP_INGEST_PORT = int(os.environ.get("UDP_INGEST_PORT", 0))  # [port] Canal UDP signé de la sonnette (0 = désactivé)
+UDP_INGEST_HOST = os.environ.get("UDP_INGEST_HOST", "0.0.0.0")
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")  # [str] Si défini, /metrics exige "Authorization: Bearer <jeton>"
+DEVICE_KEYS_TTL = 60      # [secondes] Relecture périodique de la table devices (cache des clés)
+EVENTS_PAGE_SIZE = 50     # [nombre] Taille de page par défaut de /api/events
+EVENTS_PAGE_MAX = 500     # [nombre] Taille de page max de /api/events
+DASHBOARD_SYNC_INTERVAL = 5  # [secondes] Fréquence de vérification des modifications faites par un autre processus (archive-events)
+ANALYTICS_DAYS = 90       # [jours] Fenêtre des cartes de chaleur de /admin
+ANALYTICS_DAYS_MAX = 366  # [jours] Fenêtre max de /api/analytics
+RETENTION_DAYS = int(os.environ.get("RETENTION_DAYS", 365))  # [jours] Au-delà, `flask archive-events` résume les événements par mois
+
 db = SQLAlchemy(app)
 CANADA_TZ = pytz.timezone("America/Toronto")
+broker = EventBroker(queue_size=STREAM_QUEUE_SIZE)
+
+# ==== MÉTRIQUES (/metrics) ====
+registry = Registry()
+request_seconds = Histogram(registry, "sonnette_http_request_duration_seconds",
+                            "Durée de traitement des requêtes HTTP (jusqu'au premier octet pour /stream)",
+                            ("route", "method", "status"))
+commit_seconds = Histogram(registry, "sonnette_db_commit_seconds", "Durée des commits d'ingestion")
+write_batch_size = Histogram(registry, "sonnette_db_write_batch_requests", "Requêtes d'ingestion regroupées par transaction",
+                             buckets=(1, 2, 5, 10, 20, 50, 100, 200))
+dashboard_build_seconds = Histogram(registry, "sonnette_dashboard_build_seconds",
+                                    "Recalcul de l'instantané du tableau de bord (requêtes SQL, hors cache)")
+push_seconds = Histogram(registry, "sonnette_push_send_seconds", "Durée d'un envoi Web Push réussi")
+events_total = Counter(registry, "sonnette_events_total", "Événements reçus, par type et résultat", ("type", "status"))
+Gauge(registry, "sonnette_stream_clients", "Connexions /stream ouvertes", lambda: len(broker))
+Gauge(registry, "sonnette_push_total", "Envois Web Push par résultat",
+      lambda: {(outcome,): n for outcome, n in push_dispatcher.counters.items()}, ("outcome",), kind="counter")
+Gauge(registry, "sonnette_push_queue_depth", "Envois Web Push en file", lambda: push_dispatcher.stats()["queue_depth"])
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_duration(response):
+    start = g.pop("request_start", None)
+    if start is not None:
+        # Règle de routage plutôt que chemin : nombre de séries borné
+        route = request.url_rule.rule if request.url_rule else "<inconnue>"
+        request_seconds.observe(time.perf_counter() - start, route, request.method, response.status_code)
+    return response
 
 @app.template_filter('to_local')
 def to_local(dt):
@@ -29,16 +106,55 @@ def to_local(dt):
     return dt.astimezone(CANADA_TZ).strftime("%Y-%m-%d %H:%M:%S")
 
 # ==== DB MODELS ====
+class Device(db.Model):
+    # Une sonnette de la flotte ; `key` sert de secret HTTP et de clé HMAC UDP
+    __tablename__ = 'devices'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(64), unique=True, nullable=False)
+    key = db.Column(db.String(64), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
 class BellEvent(db.Model):
     __tablename__ = 'bell_events'
     id = db.Column(db.Integer, primary_key=True)
-    timestamp = db.Column(db.DateTime, nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False, index=True)
+    event_uid = db.Column(db.String(64), unique=True, index=True)  # ID généré par la sonnette (idempotence)
+    device_id = db.Column(db.Integer, db.ForeignKey('devices.id'), index=True)  # NULL = sonnette historique (secret global)
 
 class IntrusEvent(db.Model):
     __tablename__ = 'intrus_events'
+    __table_args__ = (db.Index('ix_intrus_events_type_timestamp', 'type', 'timestamp'),)
     id = db.Column(db.Integer, primary_key=True)
     type = db.Column(db.String(32), nullable=False, default="intrus")
-    timestamp = db.Column(db.DateTime, nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False, index=True)
+    event_uid = db.Column(db.String(64), unique=True, index=True)
+    device_id = db.Column(db.Integer, db.ForeignKey('devices.id'), index=True)
+
+class EventArchive(db.Model):
+    # Résumé mensuel (mois UTC) des événements sortis de la rétention
+    __tablename__ = 'event_archive'
+    __table_args__ = (db.UniqueConstraint('month', 'kind', 'type'),)
+    id = db.Column(db.Integer, primary_key=True)
+    month = db.Column(db.String(7), nullable=False)   # "YYYY-MM"
+    kind = db.Column(db.String(8), nullable=False)    # "bell" / "intrus"
+    type = db.Column(db.String(32), nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+class EventRollup(db.Model):
+    # Cumuls par heure / jour locaux et par type (analytics.py), conservés après archivage
+    __tablename__ = 'event_rollup'
+    __table_args__ = (db.UniqueConstraint('period', 'bucket', 'type'),)
+    id = db.Column(db.Integer, primary_key=True)
+    period = db.Column(db.String(4), nullable=False)   # "hour" / "day"
+    bucket = db.Column(db.String(13), nullable=False)  # "YYYY-MM-DD HH" / "YYYY-MM-DD"
+    type = db.Column(db.String(32), nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+class EventCounter(db.Model):
+    # Totaux tenus à jour à l'ingestion (évite les COUNT(*) de /admin)
+    __tablename__ = 'event_counters'
+    name = db.Column(db.String(32), primary_key=True)  # "bell" / "intrus"
+    value = db.Column(db.Integer, nullable=False, default=0)
 
 class PushSubscription(db.Model):
     __tablename__ = 'push_subscriptions'
@@ -46,6 +162,16 @@ class PushSubscription(db.Model):
     endpoint = db.Column(db.Text, nullable=False)
     p256dh = db.Column(db.Text, nullable=False)
     auth = db.Column(db.Text, nullable=False)
+    device_id = db.Column(db.Integer, db.ForeignKey('devices.id'))  # NULL = notifications de toutes les sonnettes
+
+class TelemetryReport(db.Model):
+    # Résumé périodique de télémétrie d'une sonnette (durées de boucle, cadence ADC, latence d'envoi)
+    __tablename__ = 'telemetry_reports'
+    __table_args__ = (db.Index('ix_telemetry_reports_device_received', 'device_id', 'received_at'),)
+    id = db.Column(db.Integer, primary_key=True)
+    device_id = db.Column(db.Integer, db.ForeignKey('devices.id'))
+    received_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    data = db.Column(db.Text, nullable=False)  # JSON {"period", "timings", "gauges"}
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -53,8 +179,79 @@ class User(db.Model):
     username = db.Column(db.String(64), unique=True, nullable=False)
     password_hash = db.Column(db.String(128), nullable=False)
 
+# Colonnes/index ajoutés après coup : create_all() ne modifie pas les tables existantes
+SCHEMA_UPGRADES = [
+    ("bell_events", "event_uid", "ALTER TABLE bell_events ADD COLUMN event_uid VARCHAR(64)"),
+    ("intrus_events", "event_uid", "ALTER TABLE intrus_events ADD COLUMN event_uid VARCHAR(64)"),
+    ("bell_events", "device_id", "ALTER TABLE bell_events ADD COLUMN device_id INTEGER REFERENCES devices (id)"),
+    ("intrus_events", "device_id", "ALTER TABLE intrus_events ADD COLUMN device_id INTEGER REFERENCES devices (id)"),
+    ("push_subscriptions", "device_id", "ALTER TABLE push_subscriptions ADD COLUMN device_id INTEGER REFERENCES devices (id)"),
+]
+SCHEMA_INDEXES = [
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_bell_events_event_uid ON bell_events (event_uid)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_intrus_events_event_uid ON intrus_events (event_uid)",
+    "CREATE INDEX IF NOT EXISTS ix_bell_events_timestamp ON bell_events (timestamp)",
+    "CREATE INDEX IF NOT EXISTS ix_intrus_events_timestamp ON intrus_events (timestamp)",
+    "CREATE INDEX IF NOT EXISTS ix_intrus_events_type_timestamp ON intrus_events (type, timestamp)",
+    "CREATE INDEX IF NOT EXISTS ix_bell_events_device_id ON bell_events (device_id)",
+    "CREATE INDEX IF NOT EXISTS ix_intrus_events_device_id ON intrus_events (device_id)",
+]
+
+def upgrade_schema():
+    inspector = inspect(db.engine)
+    with db.engine.begin() as conn:
+        for table, column, ddl in SCHEMA_UPGRADES:
+            if column not in {c["name"] for c in inspector.get_columns(table)}:
+                conn.execute(text(ddl))
+        for ddl in SCHEMA_INDEXES:
+            conn.execute(text(ddl))
+
+def init_counters():
+    # Première initialisation (base existante) : un seul COUNT(*) par table, archive comprise
+    for name, model in (("bell", BellEvent), ("intrus", IntrusEvent)):
+        if db.session.get(EventCounter, name) is None:
+            archived = db.session.query(func.coalesce(func.sum(EventArchive.count), 0)).filter_by(kind=name).scalar()
+            db.session.add(EventCounter(name=name, value=model.query.count() + archived))
+    if db.session.get(EventCounter, "dashboards") is None:
+        db.session.add(EventCounter(name="dashboards", value=0))
+    db.session.commit()
+
+def bump_counters(events):
+    # À appeler avant le commit de l'ingestion : même transaction que les insertions
+    counts = {}
+    for evt_type, ts in events:
+        name = "bell" if evt_type == "bell" else "intrus"
+        counts[name] = counts.get(name, 0) + 1
+    for name, n in counts.items():
+        db.session.query(EventCounter).filter_by(name=name).update({EventCounter.value: EventCounter.value + n})
+
+def bump_rollups(events, chunk=500):
+    # Même transaction que l'ingestion ; upsert SQLite, une ligne par case touchée
+    rows = [dict(period=period, bucket=bucket, type=evt_type, count=n)
+            for (period, bucket, evt_type), n in analytics.rollup_counts(events, CANADA_TZ).items()]
+    for i in range(0, len(rows), chunk):
+        stmt = sqlite_insert(EventRollup).values(rows[i:i + chunk])
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=['period', 'bucket', 'type'],
+            set_={'count': EventRollup.count + stmt.excluded['count']},
+        ))
+
+def event_counts():
+    return {c.name: c.value for c in EventCounter.query.all()}
+
 with app.app_context():
+    if DB_TUNING:
+        install_pragmas(db.engine)
     db.create_all()
+    upgrade_schema()
+    init_counters()
+
+def load_device_keys():
+    # Appelé aussi hors requête (thread UDP) : contexte propre
+    with app.app_context():
+        return {d.id: (d.name, d.key) for d in Device.query}
+
+device_keys = DeviceKeys(load_device_keys, ttl=DEVICE_KEYS_TTL)
 
 # ==== AUTH ====
 def is_logged_in():
@@ -74,6 +271,41 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def check_secret(secret):
+    # Comparaison à temps constant
+    return isinstance(secret, str) and hmac.compare_digest(secret.encode(), SECRET_KEY.encode())
+
+def authenticate_device(data):
+    """(autorisé, device_id) d'une requête de sonnette.
+
+    Avec "device" : clé propre à la sonnette (cache mémoire, pas de requête
+    SQL) ; sans : ancienne sonnette, secret global et device_id None.
+    """
+    device_id = data.get("device")
+    if device_id is None:
+        return check_secret(data.get("secret")), None
+    if not isinstance(device_id, int) or isinstance(device_id, bool):
+        return False, None
+    return device_keys.verify(device_id, data.get("secret")), device_id
+
+def requested_device():
+    # ?device=<id> des pages et API du tableau de bord (None = toutes les sonnettes)
+    device_id = request.args.get("device", type=int)
+    if device_id is not None and device_keys.get(device_id) is None:
+        abort(404)
+    return device_id
+
+def api_login_required(f):
+    # Pour les API de lecture : session du tableau de bord, ou secret de la
+    # sonnette dans l'en-tête X-Sonnette-Secret (outils externes) ; 401 JSON
+    # plutôt qu'une redirection vers /login
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not is_logged_in() and not check_secret(request.headers.get("X-Sonnette-Secret")):
+            return jsonify({"error": "unauthorized"}), 401
+        return f(*args, **kwargs)
+    return decorated_function
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     error = None
@@ -97,43 +329,67 @@ def logout():
     return redirect(url_for('login'))
 
 # ==== FONCTIONS PRINCIPALES ====
-def send_notification_to_all(title, message):
-    subs = PushSubscription.query.all()
+def prune_subscription(sub):
+    # Abonnement expiré côté service push (404/410) : inutile de le garder
+    with app.app_context():
+        PushSubscription.query.filter_by(id=sub["id"]).delete()
+        db.session.commit()
+
+push_sender = PushSender(VAPID_PRIVATE_KEY, VAPID_CLAIMS, timeout=PUSH_TIMEOUT, pool_size=PUSH_WORKERS)
+push_dispatcher = PushDispatcher(push_sender, on_gone=prune_subscription,
+                                 workers=PUSH_WORKERS, max_retries=PUSH_MAX_RETRIES,
+                                 on_latency=push_seconds.observe)
+ingest_limiter = RateLimiter(INGEST_RATE, INGEST_BURST)
+
+def send_notification_to_all(title, message, device_id=None):
+    # Abonnés de cette sonnette et abonnés à toutes les sonnettes ; une ancienne
+    # sonnette (secret global) ne notifie que ces derniers, comme pour /stream
+    query = PushSubscription.query
+    if device_id is not None:
+        query = query.filter((PushSubscription.device_id == device_id) | PushSubscription.device_id.is_(None))
+        title = f"{title} — {device_keys.name(device_id)}"
+    else:
+        query = query.filter(PushSubscription.device_id.is_(None))
+    subs = query.all()
+    # Sérialisé une fois pour tous les abonnés
     payload = json.dumps({
         "title": title,
         "body": message,
         "icon": "/static/icon.png"
-    })
+    }).encode()
     for sub in subs:
-        try:
-            webpush(
-                subscription_info={
-                    "endpoint": sub.endpoint,
-                    "keys": {
-                        "p256dh": sub.p256dh,
-                        "auth": sub.auth
-                    }
-                },
-                data=payload,
-                vapid_private_key=VAPID_PRIVATE_KEY,
-                vapid_claims=VAPID_CLAIMS
-            )
-        except WebPushException as e:
-            print("Erreur push:", e)
+        push_dispatcher.submit({
+            "id": sub.id,
+            "endpoint": sub.endpoint,
+            "keys": {
+                "p256dh": sub.p256dh,
+                "auth": sub.auth
+            }
+        }, payload)
 
 @app.route('/')
 @login_required
 def index():
-    bells = BellEvent.query.order_by(BellEvent.timestamp.desc()).limit(10).all()
-    intrus = IntrusEvent.query.order_by(IntrusEvent.timestamp.desc()).limit(10).all()
-    return render_template("index.html", bell_events=bells, intrus_events=intrus)
+    # État initial embarqué dans la page : affiché avant même la connexion à /stream
+    device_id = requested_device()
+    data, snapshot_json, message = dashboard(device_id).get()
+    return render_template("index.html", snapshot_json=snapshot_json,
+                           devices=device_keys.all(), device_id=device_id)
 
 @app.route('/admin')
 @login_required
 def admin():
     return render_template("admin.html",
-        bell_events=BellEvent.query.count(),
-        intrus_events=IntrusEvent.query.count()
+        bell_events=event_counts().get("bell", 0),
+        intrus_events=event_counts().get("intrus", 0),
+        archive=EventArchive.query.order_by(EventArchive.month.desc(), EventArchive.kind, EventArchive.type).all(),
+        activity={name: activity(name, ANALYTICS_DAYS) for name in ("bell", "intrus")},
+        analytics_days=ANALYTICS_DAYS,
+        weekdays=analytics.WEEKDAYS,
+        devices=Device.query.order_by(Device.id).all(),
+        push_stats=dict(push_dispatcher.stats(), coalesced=notif_coalescer.counters["coalesced"],
+                        rate_limited=ingest_limiter.limited),
+        telemetry=latest_telemetry()
     )
 
 @app.route('/reset', methods=['POST'])
@@ -141,80 +397,515 @@ def admin():
 def reset():
     BellEvent.query.delete()
     IntrusEvent.query.delete()
+    EventArchive.query.delete()
+    EventCounter.query.filter(EventCounter.name != "dashboards").update({EventCounter.value: 0})
+    EventRollup.query.delete()
+    bump_dashboard_generation()
     db.session.commit()
+    invalidate_dashboards()
     return redirect(url_for('admin'))
 
+@dashboard_build_seconds.time()
+def dashboard_state(device_id=None):
+    bells, intrus = BellEvent.query, IntrusEvent.query
+    if device_id is not None:
+        bells, intrus = bells.filter_by(device_id=device_id), intrus.filter_by(device_id=device_id)
+    bells = [
+        to_local(b.timestamp)
+        for b in bells.order_by(BellEvent.timestamp.desc()).limit(10).all()
+    ]
+    intrus = [
+        {"timestamp": to_local(i.timestamp), "type": getattr(i, "type", "intrus")}
+        for i in intrus.order_by(IntrusEvent.timestamp.desc()).limit(10).all()
+    ]
+    return {
+        'bell': bool(bells),
+        'intrus': bool(intrus),
+        'bell_events': bells,
+        'intrus_events': intrus
+    }
+
+# Instantanés partagés par index() et /stream, recalculés seulement après une
+# ingestion ; un par sonnette consultée, None = toutes les sonnettes
+dashboards = {}
+
+# Génération partagée (ligne "dashboards" d'event_counters) : incrémentée par
+# chaque écriture d'événements (ingestion, reset, flask archive-events), quel
+# que soit le processus ; chaque worker gunicorn invalide ses instantanés quand
+# il la voit changer. Les deltas /stream, eux, ne partent que du processus qui
+# a reçu l'événement.
+dashboards_sync = {"generation": None, "checked": None}
+
+def bump_dashboard_generation():
+    # Dans la transaction qui modifie les événements
+    db.session.query(EventCounter).filter_by(name="dashboards").update({EventCounter.value: EventCounter.value + 1})
+
+def sync_dashboards():
+    now = time.monotonic()
+    if dashboards_sync["checked"] is not None and now - dashboards_sync["checked"] < DASHBOARD_SYNC_INTERVAL:
+        return
+    dashboards_sync["checked"] = now
+    row = db.session.get(EventCounter, "dashboards")
+    generation = row.value if row is not None else 0
+    if dashboards_sync["generation"] is not None and generation != dashboards_sync["generation"]:
+        invalidate_dashboards()
+    dashboards_sync["generation"] = generation
+
+def dashboard(device_id=None):
+    sync_dashboards()
+    cache = dashboards.get(device_id)
+    if cache is None:
+        cache = dashboards.setdefault(device_id, SnapshotCache(lambda: dashboard_state(device_id)))
+    return cache
+
+def invalidate_dashboards(device_ids=None):
+    """Invalide la vue globale et celles de `device_ids` (toutes si None)."""
+    for device_id, cache in list(dashboards.items()):
+        if device_ids is None or device_id is None or device_id in device_ids:
+            cache.invalidate()
+
+def publish_events(events, device_id=None):
+    # Delta poussé aux clients /stream de cette sonnette et à ceux de toutes les
+    # sonnettes (même format que l'instantané, plus récent en premier)
+    events = sorted(events, key=lambda e: e[1], reverse=True)
+    broker.publish({
+        'bell_events': [to_local(ts) for evt_type, ts in events if evt_type == "bell"][:10],
+        'intrus_events': [
+            {"timestamp": to_local(ts), "type": evt_type}
+            for evt_type, ts in events if evt_type != "bell"
+        ][:10]
+    }, event="delta", topic=device_id)
+
 @app.route('/stream')
 @login_required
 def stream():
+    # Abonnement avant l'instantané : aucun événement ne peut tomber entre les deux
+    device_id = requested_device()
+    sub = broker.subscribe(topic=device_id)
+    data, snapshot_json, snapshot = dashboard(device_id).get()
+    # stream_with_context garde le contexte (et donc la session) pendant toute la
+    # connexion : on rend la connexion au pool et on ferme la transaction de
+    # lecture, qui empêcherait sinon les checkpoints du WAL
+    db.session.remove()
+
     @stream_with_context
     def event_stream():
-        while True:
-            bells = [
-                to_local(b.timestamp)
-                for b in BellEvent.query.order_by(BellEvent.timestamp.desc()).limit(10).all()
-            ]
-            intrus = [
-                {"timestamp": to_local(i.timestamp), "type": getattr(i, "type", "intrus")}
-                for i in IntrusEvent.query.order_by(IntrusEvent.timestamp.desc()).limit(10).all()
-            ]
-
-            state = {
-                'bell': bool(bells),
-                'intrus': bool(intrus),
-                'bell_events': bells,
-                'intrus_events': intrus 
-            }
+        try:
+            yield snapshot
+            for message in sub.messages(STREAM_HEARTBEAT):
+                yield message if message is not None else ": ping\n\n"
+        finally:
+            broker.unsubscribe(sub)
+    return Response(event_stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/metrics')
+def metrics():
+    # Format d'exposition texte de Prometheus
+    if METRICS_TOKEN and not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {METRICS_TOKEN}"):
+        return Response("unauthorized\n", status=401, mimetype="text/plain")
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+# ==== HISTORIQUE (API) ====
+# Les deux tables sont parcourues comme une seule liste triée, du plus récent au
+# plus ancien, sur la clé (timestamp, kind, id) : kind départage une sonnerie et
+# une alerte de même horodatage. Le curseur encode la clé du dernier élément
+# renvoyé ; chaque page est une recherche par index sur timestamp, sans OFFSET.
+EVENT_KINDS = ((0, BellEvent), (1, IntrusEvent))
+
+def encode_cursor(ts, kind, event_id):
+    raw = f"{ts.isoformat()}|{kind}|{event_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        ts, kind, event_id = raw.split("|")
+        return datetime.fromisoformat(ts), int(kind), int(event_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("invalid cursor")
+
+def parse_utc(value, name):
+    # Dates sans fuseau = UTC, comme les horodatages stockés
+    try:
+        dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        raise ValueError(f"invalid {name}")
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+def after_cursor(model, kind, cursor):
+    # Clé (timestamp, kind, id) strictement inférieure au curseur, kind fixé par la table
+    ts, cursor_kind, cursor_id = cursor
+    if kind < cursor_kind:
+        return model.timestamp <= ts
+    if kind > cursor_kind:
+        return model.timestamp < ts
+    return (model.timestamp < ts) | ((model.timestamp == ts) & (model.id < cursor_id))
+
+def query_events(types, start, end, cursor, limit, device_id=None):
+    """Page d'historique : liste de (timestamp, kind, id, type), plus récent en premier."""
+    rows = []
+    for kind, model in EVENT_KINDS:
+        query = model.query
+        if device_id is not None:
+            query = query.filter(model.device_id == device_id)
+        if model is BellEvent:
+            if "bell" not in types:
+                continue
+        else:
+            intrus_types = types - {"bell"}
+            if not intrus_types:
+                continue
+            if intrus_types != ALL_INTRUS_TYPES:
+                query = query.filter(IntrusEvent.type.in_(intrus_types))
+        if start is not None:
+            query = query.filter(model.timestamp >= start)
+        if end is not None:
+            query = query.filter(model.timestamp < end)
+        if cursor is not None:
+            query = query.filter(after_cursor(model, kind, cursor))
+        for e in query.order_by(model.timestamp.desc(), model.id.desc()).limit(limit):
+            rows.append((e.timestamp, kind, e.id, getattr(e, "type", "bell")))
+    rows.sort(reverse=True)
+    return rows[:limit]
+
+@app.route('/api/events')
+@api_login_required
+def list_events():
+    """Historique paginé : ?type=bell,intrus_bruit&from=…&to=…&limit=…&cursor=…&device=…
+
+    `type=intrus` regroupe tous les types d'alerte (group_types).
+
+    `from` est inclus, `to` exclu (ISO 8601, UTC par défaut). La réponse
+    contient `next`, le curseur de la page suivante (null à la fin).
+    """
+    args = request.args
+    try:
+        # "intrus" = tous les types d'alerte, comme pour /api/analytics
+        names = set(filter(None, args.get("type", "").split(",")))
+        types = set().union(*(group_types(name) for name in names)) if names else ALL_TYPES
+        start = parse_utc(args["from"], "from") if "from" in args else None
+        end = parse_utc(args["to"], "to") if "to" in args else None
+        cursor = decode_cursor(args["cursor"]) if "cursor" in args else None
+        limit = int(args.get("limit", EVENTS_PAGE_SIZE))
+        if not 0 < limit <= EVENTS_PAGE_MAX:
+            raise ValueError(f"limit must be between 1 and {EVENTS_PAGE_MAX}")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-            yield f"data: {json.dumps(state)}\n\n"
-            time.sleep(2)
-    return Response(event_stream(), mimetype='text/event-stream')
+    rows = query_events(types, start, end, cursor, limit + 1, requested_device())
+    page, more = rows[:limit], len(rows) > limit
+    body = {
+        "events": [{"id": event_id, "type": evt_type, "timestamp": ts.isoformat() + "Z"}
+                   for ts, kind, event_id, evt_type in page],
+        "next": encode_cursor(*page[-1][:3]) if more else None,
+    }
+    response = Response(json.dumps(body, separators=(",", ":"), ensure_ascii=False), mimetype="application/json")
+    # ETag = empreinte du contenu : une page inchangée répond 304 sans corps
+    response.add_etag()
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response.make_conditional(request)
+
+# ==== STATISTIQUES D'ACTIVITÉ ====
+def group_types(name):
+    # "intrus" regroupe tous les types d'alerte
+    if name == "intrus":
+        return ALL_INTRUS_TYPES
+    if name in ALL_TYPES:
+        return {name}
+    raise ValueError("invalid type")
+
+def activity(name, days):
+    """Carte de chaleur jour de semaine x heure et série journalière sur les `days` derniers jours."""
+    types = group_types(name)
+    start = analytics.first_bucket(days, CANADA_TZ)
+    rows = {}
+    for period in (analytics.HOUR, analytics.DAY):
+        rows[period] = db.session.query(EventRollup.bucket, EventRollup.count).filter(
+            EventRollup.period == period, EventRollup.bucket >= start, EventRollup.type.in_(types)).all()
+    grid = analytics.heatmap(rows[analytics.HOUR])
+    return {
+        "heatmap": grid,
+        "max": max(max(row) for row in grid),
+        "daily": analytics.daily_series(rows[analytics.DAY], start, days),
+    }
+
+@app.route('/api/analytics')
+@api_login_required
+def analytics_api():
+    """?type=bell,intrus,intrus_bruit…&days=… (heure locale du serveur, lundi = ligne 0)."""
+    try:
+        names = [n for n in request.args.get("type", "bell,intrus").split(",") if n]
+        days = int(request.args.get("days", ANALYTICS_DAYS))
+        if not 0 < days <= ANALYTICS_DAYS_MAX:
+            raise ValueError(f"days must be between 1 and {ANALYTICS_DAYS_MAX}")
+        result = {name: activity(name, days) for name in names}
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"days": days, "timezone": CANADA_TZ.zone, "activity": result})
+
+# ==== INGESTION DES ÉVÉNEMENTS ====
+@app.route('/api/ping')
+def ping():
+    # Utilisé par la sonnette pour ouvrir / tester sa connexion keep-alive
+    return jsonify({"status": "ok"})
+
+# type -> (titre, message) de la notification push
+EVENT_TYPES = {
+    "bell": ("🔔 Nouvelle alerte", "Quelqu’un a sonné à la porte."),
+    #"intrus": ("🚨 Détection d’intrus", "Un mouvement a été détecté par le PIR."),
+    "intrus_bruit": ("🔊 Bruit suspect détecté", "Un bruit a été détecté (microphone)."),
+    "intrus_presence": ("👤 Présence détectée", "Présence détectée devant la porte (PIR)."),
+    "intrus_presence_et_bruit": ("🚨 Intrus (son + mouvement)", "Bruit ET mouvement détectés !"),
+}
+
+# Types acceptés en lecture : "intrus" reste présent dans les anciennes données
+ALL_INTRUS_TYPES = (set(EVENT_TYPES) | {"intrus"}) - {"bell"}
+ALL_TYPES = ALL_INTRUS_TYPES | {"bell"}
+
+def new_event(evt_type, ts, uid=None, device_id=None):
+    if evt_type == "bell":
+        return BellEvent(timestamp=ts, event_uid=uid, device_id=device_id)
+    return IntrusEvent(timestamp=ts, type=evt_type, event_uid=uid, device_id=device_id)
+
+def existing_uids(uids):
+    uids = list(uids)
+    if not uids:
+        return set()
+    found = set()
+    for model in (BellEvent, IntrusEvent):
+        found.update(uid for (uid,) in db.session.query(model.event_uid).filter(model.event_uid.in_(uids)))
+    return found
+
+def store_events(jobs):
+    """Enregistre plusieurs lots (device_id, [(uid, type, timestamp)]) en une seule transaction.
+
+    Renvoie, pour chaque lot, la liste des événements créés (True) ou déjà
+    connus (False) ; un uid vu dans un lot précédent du même groupe compte
+    comme doublon. En cas de course avec un autre processus, les doublons
+    sont recalculés et la transaction rejouée une fois.
+    """
+    for attempt in range(2):
+        seen = existing_uids(uid for device_id, items in jobs for uid, evt_type, ts in items if uid is not None)
+        results, created = [], []
+        for device_id, items in jobs:
+            flags = []
+            for uid, evt_type, ts in items:
+                is_new = uid is None or uid not in seen
+                if uid is not None:
+                    seen.add(uid)
+                if is_new:
+                    created.append((uid, evt_type, ts, device_id))
+                flags.append(is_new)
+            results.append(flags)
+        db.session.add_all(new_event(evt_type, ts, uid, device_id) for uid, evt_type, ts, device_id in created)
+        bump_counters([(evt_type, ts) for uid, evt_type, ts, device_id in created])
+        bump_rollups([(evt_type, ts) for uid, evt_type, ts, device_id in created])
+        if created:
+            bump_dashboard_generation()
+        try:
+            start = time.perf_counter()
+            db.session.commit()
+            commit_seconds.observe(time.perf_counter() - start)
+            for (device_id, items), flags in zip(jobs, results):
+                for (uid, evt_type, ts), is_new in zip(items, flags):
+                    events_total.inc(1, evt_type, "created" if is_new else "duplicate")
+            if created:
+                invalidate_dashboards({device_id for uid, evt_type, ts, device_id in created})
+            return results
+        except IntegrityError:
+            db.session.rollback()
+            if attempt:
+                raise
+
+def write_jobs(jobs):
+    # Thread écrivain : contexte (et session) propres à chaque groupe
+    write_batch_size.observe(len(jobs))
+    with app.app_context():
+        try:
+            return store_events(jobs)
+        except Exception:
+            # Groupe annulé : WriteBatcher rejoue chaque lot seul dans une session propre
+            db.session.rollback()
+            raise
+
+writer = WriteBatcher(write_jobs, max_batch=DB_WRITE_BATCH)
+
+def save_events(items, device_id=None):
+    """Enregistre un lot [(uid, type, timestamp)] d'une sonnette et renvoie la liste créé/doublon."""
+    if DB_TUNING:
+        return writer.submit((device_id, items)).result()
+    return store_events([(device_id, items)])[0]
+
+def send_coalesced(key, count, summary):
+    # Appelé tout de suite pour le début d'une rafale, puis depuis un Timer pour le résumé
+    device_id, evt_type = key
+    title, message = EVENT_TYPES[evt_type]
+    if summary:
+        message = f"{message} (+{count} en {NOTIF_COALESCE_WINDOW} s)"
+    elif count > 1:
+        message = f"{message} (×{count})"
+    with app.app_context():
+        send_notification_to_all(title, message, device_id)
+
+notif_coalescer = NotificationCoalescer(send_coalesced, window=NOTIF_COALESCE_WINDOW)
+
+def notify_events(events, device_id=None):
+    # Une seule notification par type, même pour un lot rattrapé après une
+    # coupure ; les rafales sont regroupées (notif_coalescer)
+    publish_events(events, device_id)
+    counts = {}
+    for evt_type, ts in events:
+        counts[evt_type] = counts.get(evt_type, 0) + 1
+    for evt_type, count in counts.items():
+        notif_coalescer.submit((device_id, evt_type), count)
+
+def acquire_types(device_id, counts):
+    """Prend les jetons de chaque type de `counts` ({type: nombre}) séparément ; renvoie {type: délai} des types refusés.
+
+    Coût : un jeton par tranche de BATCH_EVENTS_PER_TOKEN événements d'un type,
+    ce qui borne le débit stocké même par gros lots. Chaque type a son seau :
+    un rattrapage d'alertes qui vide celui d'intrus_bruit ne retarde pas une
+    sonnerie.
+    """
+    refused = {}
+    for evt_type, n in counts.items():
+        wait = ingest_limiter.acquire({(device_id, evt_type): math.ceil(n / BATCH_EVENTS_PER_TOKEN)})
+        if wait:
+            refused[evt_type] = wait
+            events_total.inc(n, evt_type, "rate_limited")
+    return refused
+
+def rate_limited_response(wait):
+    # Retry-After : la sonnette garde ses événements et réessaie plus tard
+    return jsonify({"error": "rate limited"}), 429, {"Retry-After": str(math.ceil(wait))}
 
 @app.route('/api/sonnette', methods=['POST'])
 def receive_sonnette():
     data = request.get_json()
-    if not data or data.get("secret") != SECRET_KEY:
+    authorized, device_id = authenticate_device(data) if isinstance(data, dict) else (False, None)
+    if not authorized:
         return jsonify({"error": "unauthorized"}), 401
 
     evt_type = data.get("type")
     ts_raw = data.get("timestamp")
+    uid = data.get("id")
     try:
-        ts = datetime.fromisoformat(ts_raw)
-    except:
-        return jsonify({"error": "invalid timestamp"}), 400
+        # UTC sans fuseau, comme en base : naïfs et avec décalage restent comparables
+        ts = parse_utc(ts_raw, "timestamp")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    if evt_type == "bell":
-        db.session.add(BellEvent(timestamp=ts))
-        db.session.commit()
-        send_notification_to_all("🔔 Nouvelle alerte", "Quelqu’un a sonné à la porte.")
-        return jsonify({"status": "bell event recorded"})
+    if evt_type not in EVENT_TYPES:
+        return jsonify({"error": "invalid type"}), 400
+    # ID facultatif (anciennes sonnettes), mêmes règles que dans un lot
+    if uid is not None and (not isinstance(uid, str) or not 0 < len(uid) <= 64):
+        return jsonify({"error": "invalid id"}), 400
 
-    #elif evt_type == "intrus":
-    #    db.session.add(IntrusEvent(timestamp=ts))
-    #    db.session.commit()
-    #    send_notification_to_all("🚨 Détection d’intrus", "Un mouvement a été détecté par le PIR.")
-    #    return jsonify({"status": "intrus event recorded"})
+    refused = acquire_types(device_id, {evt_type: 1})
+    if refused:
+        return rate_limited_response(refused[evt_type])
 
-    elif evt_type == "intrus_bruit":
-        db.session.add(IntrusEvent(timestamp=ts, type=evt_type))
-        db.session.commit()
-        send_notification_to_all("🔊 Bruit suspect détecté", "Un bruit a été détecté (microphone).")
-        return jsonify({"status": "intrus_bruit event recorded"})
+    if not save_events([(uid, evt_type, ts)], device_id)[0]:
+        # Même ID déjà reçu (renvoi de la sonnette)
+        return jsonify({"status": f"{evt_type} event already recorded"})
+    notify_events([(evt_type, ts)], device_id)
+    return jsonify({"status": f"{evt_type} event recorded"})
 
-    elif evt_type == "intrus_presence":
-        db.session.add(IntrusEvent(timestamp=ts, type=evt_type))
-        db.session.commit()
-        send_notification_to_all("👤 Présence détectée", "Présence détectée devant la porte (PIR).")
-        return jsonify({"status": "intrus_presence event recorded"})
+def parse_batch_item(item):
+    """Retourne (uid, type, timestamp) ou lève ValueError avec le motif du rejet."""
+    if not isinstance(item, dict):
+        raise ValueError("invalid item")
+    uid = item.get("id")
+    if not isinstance(uid, str) or not 0 < len(uid) <= 64:
+        raise ValueError("invalid id")
+    if item.get("type") not in EVENT_TYPES:
+        raise ValueError("invalid type")
+    return uid, item["type"], parse_utc(item.get("timestamp"), "timestamp")
 
-    elif evt_type == "intrus_presence_et_bruit":
-        db.session.add(IntrusEvent(timestamp=ts, type=evt_type))
-        db.session.commit()
-        send_notification_to_all("🚨 Intrus (son + mouvement)", "Bruit ET mouvement détectés !")
-        return jsonify({"status": "intrus_presence_et_bruit event recorded"})
+@app.route('/api/sonnette/batch', methods=['POST'])
+def receive_sonnette_batch():
+    data = request.get_json()
+    authorized, device_id = authenticate_device(data) if isinstance(data, dict) else (False, None)
+    if not authorized:
+        return jsonify({"error": "unauthorized"}), 401
+    items = data.get("events")
+    if not isinstance(items, list) or len(items) > BATCH_MAX_EVENTS:
+        return jsonify({"error": f"events must be a list of at most {BATCH_MAX_EVENTS} items"}), 400
 
-    else:
-        return jsonify({"error": "invalid type"}), 400
+    results = [None] * len(items)
+    pending = {}  # uid -> (index, type, timestamp)
+    for index, item in enumerate(items):
+        try:
+            uid, evt_type, ts = parse_batch_item(item)
+        except ValueError as e:
+            results[index] = {"id": item.get("id") if isinstance(item, dict) else None,
+                              "status": "rejected", "error": str(e)}
+            continue
+        if uid in pending:
+            results[index] = {"id": uid, "status": "duplicate"}
+        else:
+            pending[uid] = (index, evt_type, ts)
+
+    # Un petit lot de rattrapage coûte autant qu'un envoi isolé, un gros lot plusieurs jetons
+    counts = {}
+    for index, evt_type, ts in pending.values():
+        counts[evt_type] = counts.get(evt_type, 0) + 1
+    refused = acquire_types(device_id, counts)
+    if refused and len(refused) == len(counts):
+        return rate_limited_response(max(refused.values()))
+    # Types sans jeton : refusés élément par élément, la sonnette les garde et
+    # les renvoie après retry_after ; les autres types sont enregistrés
+    for uid, (index, evt_type, ts) in list(pending.items()):
+        if evt_type in refused:
+            results[index] = {"id": uid, "status": "rate_limited"}
+            del pending[uid]
+
+    # Une seule transaction pour tout le lot (partagée avec les requêtes concurrentes)
+    flags = save_events([(uid, evt_type, ts) for uid, (index, evt_type, ts) in pending.items()], device_id)
+    created = []
+    for (uid, (index, evt_type, ts)), is_new in zip(pending.items(), flags):
+        results[index] = {"id": uid, "status": "created" if is_new else "duplicate"}
+        if is_new:
+            created.append((evt_type, ts))
+    if created:
+        notify_events(created, device_id)
+    if refused:
+        return jsonify({"results": results, "retry_after": math.ceil(max(refused.values()))})
+    return jsonify({"results": results})
+
+def datagram_key(device):
+    # Appareil 0 : ancienne sonnette, secret global
+    if device == 0:
+        return SECRET_KEY.encode()
+    entry = device_keys.get(device)
+    return entry[1].encode() if entry else None
+
+def ingest_datagram(device, evt_type, ts, uid):
+    # Appelé par le thread UDP (datagram.py) pour chaque datagramme authentique
+    if evt_type not in EVENT_TYPES:
+        return REJECTED
+    device_id = device or None
+    if ingest_limiter.acquire([(device_id, evt_type)]):
+        return RATE_LIMITED
+    ts = datetime.fromtimestamp(ts, timezone.utc).replace(tzinfo=None)
+    with app.app_context():
+        if not save_events([(uid, evt_type, ts)], device_id)[0]:
+            return DUPLICATE
+        notify_events([(evt_type, ts)], device_id)
+    return CREATED
+
+# Dans le processus web (un seul worker gunicorn) : le broker /stream et le
+# cache du tableau de bord sont en mémoire. Démarré à la première requête
+# (/api/ping de la sonnette au démarrage) ; d'ici là, la sonnette passe par HTTP.
+udp_listener = DatagramListener(UDP_INGEST_HOST, UDP_INGEST_PORT, datagram_key, ingest_datagram) if UDP_INGEST_PORT else None
+
+@app.before_request
+def start_udp_listener():
+    if udp_listener is not None:
+        udp_listener.ensure_started()
 
 
 @app.route('/subscribe', methods=['POST'])
@@ -226,11 +917,152 @@ def subscribe():
     sub = PushSubscription(
         endpoint=data['endpoint'],
         p256dh=data['keys']['p256dh'],
-        auth=data['keys']['auth']
+        auth=data['keys']['auth'],
+        device_id=requested_device()
     )
     db.session.add(sub)
     db.session.commit()
     return jsonify({'status': 'subscribed'})
 
+# ==== TÉLÉMÉTRIE DES SONNETTES ====
+TIMING_FIELDS = ("n", "mean", "p50", "p95", "p99", "max")
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def parse_telemetry(report):
+    """Résumé {"period", "timings", "gauges"} réduit aux champs affichés par /admin ; ValueError sinon."""
+    if not isinstance(report, dict) or not is_number(report.get("period")):
+        raise ValueError("invalid telemetry")
+    timings, gauges = report.get("timings", {}), report.get("gauges", {})
+    if not isinstance(timings, dict) or not isinstance(gauges, dict):
+        raise ValueError("invalid telemetry")
+    for timing in timings.values():
+        if not isinstance(timing, dict) or not all(is_number(timing.get(f)) for f in TIMING_FIELDS):
+            raise ValueError("invalid timing")
+    if not all(value is None or is_number(value) for value in gauges.values()):
+        raise ValueError("invalid gauge")
+    return {"period": report["period"],
+            "timings": {str(name): {f: t[f] for f in TIMING_FIELDS} for name, t in timings.items()},
+            "gauges": gauges}
+
+@app.route('/api/telemetry', methods=['POST'])
+def receive_telemetry():
+    if (request.content_length or 0) > TELEMETRY_MAX_BYTES:
+        return jsonify({"error": "telemetry too large"}), 413
+    data = request.get_json()
+    authorized, device_id = authenticate_device(data) if isinstance(data, dict) else (False, None)
+    if not authorized:
+        return jsonify({"error": "unauthorized"}), 401
+    try:
+        report = parse_telemetry(data.get("telemetry"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    wait = ingest_limiter.acquire([(device_id, "telemetry")])
+    if wait:
+        return jsonify({"error": "rate limited"}), 429, {"Retry-After": str(math.ceil(wait))}
+
+    now = datetime.utcnow()
+    db.session.add(TelemetryReport(device_id=device_id, received_at=now, data=json.dumps(report)))
+    # Purge au fil de l'eau : un résumé toutes les quelques minutes, pas besoin de cron
+    TelemetryReport.query.filter(
+        TelemetryReport.device_id.is_(device_id) if device_id is None else TelemetryReport.device_id == device_id,
+        TelemetryReport.received_at < now - timedelta(days=TELEMETRY_RETENTION_DAYS),
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return jsonify({"status": "ok"})
+
+def latest_telemetry():
+    """[(nom de la sonnette, reçu le, résumé)] : dernier résumé de chaque sonnette."""
+    latest = db.session.query(func.max(TelemetryReport.id)).group_by(TelemetryReport.device_id)
+    reports = TelemetryReport.query.filter(TelemetryReport.id.in_(latest)).order_by(TelemetryReport.device_id).all()
+    return [(device_keys.name(r.device_id) if r.device_id is not None else "sonnette principale",
+             r.received_at, json.loads(r.data)) for r in reports]
+
+# ==== RÉTENTION ====
+def archive_events(before):
+    """Résume par mois (UTC) les événements antérieurs à `before` dans event_archive, puis les supprime.
+
+    Résumé et suppression sont faits dans la même transaction ; les compteurs
+    de /admin ne bougent pas (ils comptent aussi l'archive). Lancée par cron
+    dans un autre processus : les workers web voient la génération des
+    tableaux de bord changer et invalident leurs instantanés (sync_dashboards).
+    """
+    archived = 0
+    sources = (
+        ("bell", BellEvent, func.strftime('%Y-%m', BellEvent.timestamp), None),
+        ("intrus", IntrusEvent, func.strftime('%Y-%m', IntrusEvent.timestamp), IntrusEvent.type),
+    )
+    for kind, model, month, type_col in sources:
+        columns = [month, func.count()] + ([type_col] if type_col is not None else [])
+        query = db.session.query(*columns).filter(model.timestamp < before).group_by(*columns[:1] + columns[2:])
+        for row in query:
+            evt_type = row[2] if type_col is not None else "bell"
+            entry = EventArchive.query.filter_by(month=row[0], kind=kind, type=evt_type).first()
+            if entry is None:
+                entry = EventArchive(month=row[0], kind=kind, type=evt_type, count=0)
+                db.session.add(entry)
+            entry.count += row[1]
+            archived += row[1]
+        model.query.filter(model.timestamp < before).delete(synchronize_session=False)
+    bump_dashboard_generation()
+    db.session.commit()
+    invalidate_dashboards()
+    return archived
+
+@app.cli.command("archive-events")
+@click.option("--days", default=RETENTION_DAYS, show_default=True, help="Âge (jours) au-delà duquel archiver.")
+def archive_events_command(days):
+    """Archive les événements plus vieux que --days jours (à lancer par cron)."""
+    n = archive_events(datetime.utcnow() - timedelta(days=days))
+    click.echo(f"{n} événement(s) archivé(s).")
+
+@app.cli.command("add-device")
+@click.argument("name")
+def add_device_command(name):
+    """Enregistre une sonnette et affiche son identifiant et sa clé (DEVICE_ID / SECRET_KEY du client)."""
+    if Device.query.filter_by(name=name).first() is not None:
+        raise click.ClickException(f"La sonnette « {name} » existe déjà.")
+    device = Device(name=name, key=secrets.token_urlsafe(32))
+    db.session.add(device)
+    db.session.commit()
+    click.echo(f"id : {device.id}\nclé : {device.key}")
+
+@app.cli.command("backfill-analytics")
+@click.option("--chunk", default=5000, show_default=True, help="Événements agrégés par passe.")
+def backfill_analytics_command(chunk):
+    """Recalcule les cumuls horaires/journaliers à partir des événements bruts.
+
+    Seuls les jours couverts entièrement par les événements encore présents
+    sont recalculés : archive-events coupe à un instant UTC quelconque, le jour
+    du plus ancien événement restant garde donc ses cumuls (part archivée
+    comprise), comme les jours plus anciens.
+    """
+    oldest = [db.session.query(func.min(model.timestamp)).scalar() for kind, model in EVENT_KINDS]
+    oldest = [ts for ts in oldest if ts is not None]
+    if not oldest:
+        click.echo("Aucun événement.")
+        return
+    hour, day = analytics.local_buckets(min(oldest), CANADA_TZ)
+    start_day = datetime.strptime(day, "%Y-%m-%d")
+    if EventArchive.query.first() is not None:
+        start_day += timedelta(days=1)
+    start = start_day.strftime("%Y-%m-%d")
+    since = CANADA_TZ.localize(start_day).astimezone(timezone.utc).replace(tzinfo=None)
+
+    EventRollup.query.filter(EventRollup.bucket >= start).delete()
+    total = 0
+    queries = (
+        db.select(literal("bell"), BellEvent.timestamp).where(BellEvent.timestamp >= since),
+        db.select(IntrusEvent.type, IntrusEvent.timestamp).where(IntrusEvent.timestamp >= since),
+    )
+    for query in queries:
+        # Par paquets : la table brute ne tient pas forcément en mémoire
+        for rows in db.session.execute(query, execution_options={"yield_per": chunk}).partitions():
+            bump_rollups(rows)
+            total += len(rows)
+    db.session.commit()
+    click.echo(f"{total} événement(s) agrégé(s) depuis le {start}.")
+
 if __name__ == "__main__":
     app.run(host="127.0.0.1", port=8000)
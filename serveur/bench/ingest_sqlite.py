@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# Débit d'ingestion SQLite sous lecteurs concurrents.
+#
+# Des threads « sonnette » envoient des événements sur /api/sonnette pendant que
+# des threads « tableau de bord » relisent l'état (requête de /stream et /) en
+# boucle, sur une base temporaire. À comparer avec et sans les réglages :
+#   python bench/ingest_sqlite.py
+#   python bench/ingest_sqlite.py --baseline     # SONNETTE_DB_TUNING=0
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Débit d'ingestion SQLite avec lecteurs concurrents.")
+    parser.add_argument("--writers", type=int, default=8, help="requêtes d'ingestion simultanées")
+    parser.add_argument("--readers", type=int, default=8, help="lecteurs du tableau de bord simultanés")
+    parser.add_argument("--events", type=int, default=2000, help="nombre total d'événements envoyés")
+    parser.add_argument("--baseline", action="store_true", help="sans WAL, pool ni écrivain unique")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench-sonnette-")
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tmp, "bench.db")
+    os.environ["SONNETTE_DB_TUNING"] = "0" if args.baseline else "1"
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+    import app as server
+    # Une seule sonnette bien plus bavarde qu'en vrai : on mesure SQLite, pas la limitation (429)
+    server.ingest_limiter.rate = server.ingest_limiter.burst = 1e9
+
+    latencies, errors, reads = [], [], [0]
+    done = threading.Event()
+    per_writer = args.events // args.writers
+
+    def writer():
+        client = server.app.test_client()
+        for _ in range(per_writer):
+            body = {"secret": server.SECRET_KEY, "id": uuid.uuid4().hex,
+                    "type": "intrus_bruit", "timestamp": datetime.now().isoformat()}
+            start = time.perf_counter()
+            r = client.post("/api/sonnette", json=body)
+            latencies.append(time.perf_counter() - start)
+            if r.status_code != 200:
+                errors.append(r.status_code)
+
+    def reader():
+        while not done.is_set():
+            with server.app.app_context():
+                server.dashboard_state()
+                server.db.session.remove()
+            reads[0] += 1
+
+    readers = [threading.Thread(target=reader) for _ in range(args.readers)]
+    writers = [threading.Thread(target=writer) for _ in range(args.writers)]
+    for t in readers:
+        t.start()
+    wall = time.perf_counter()
+    for t in writers:
+        t.start()
+    for t in writers:
+        t.join()
+    wall = time.perf_counter() - wall
+    done.set()
+    for t in readers:
+        t.join()
+
+    mode = "sans réglages" if args.baseline else "WAL + écrivain unique"
+    print(f"{mode} : {len(latencies)} événements en {wall:.2f} s = {len(latencies) / wall:.0f} év/s, "
+          f"p50 {percentile(latencies, 50) * 1000:.1f} ms, p99 {percentile(latencies, 99) * 1000:.1f} ms, "
+          f"{len(errors)} erreurs ; {reads[0] / wall:.0f} lectures/s ({args.readers} lecteurs)")
+    if not args.baseline:
+        stats = server.writer.stats()
+        print(f"écrivain : {stats['jobs']} requêtes en {stats['batches']} transactions")
+
+
+if __name__ == "__main__":
+    main()
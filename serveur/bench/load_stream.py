@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# Charge de bout en bout : ingestion, diffusion /stream et notifications push.
+#
+# L'application tourne sur une base SQLite temporaire ; les notifications
+# partent (chiffrées, signées VAPID) vers un faux service push local. Des
+# « sonnettes » envoient des événements sur /api/sonnette à débit fixé (boucle
+# ouverte : un serveur lent ne ralentit pas le débit demandé) pendant que N
+# clients restent connectés à /stream. Mesures : débit, latence d'ingestion
+# p50/p99, délai sonnette -> client SSE, notifications reçues, croissance de la base.
+#   python bench/load_stream.py --rate 50 --duration 20 --streams 20
+#   python bench/load_stream.py --push-delay 0.5 --json resultats.json
+
+import argparse
+import base64
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+
+# Horodatages fictifs, une seconde d'écart par événement : l'heure locale
+# affichée dans les messages SSE identifie l'événement (janvier : pas de
+# changement d'heure)
+BASE_TS = datetime(2030, 1, 1)
+
+
+def percentile(values, p):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+def db_size(path):
+    return sum(os.path.getsize(path + suffix) for suffix in ("", "-wal") if os.path.exists(path + suffix))
+
+
+class PushStub(ThreadingHTTPServer):
+    """Faux service push : répond 201 après `delay` secondes et compte les notifications."""
+
+    daemon_threads = True
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.received = 0
+        self.lock = threading.Lock()
+        super().__init__(("127.0.0.1", 0), PushHandler)
+
+    def endpoint(self, n):
+        return f"http://127.0.0.1:{self.server_address[1]}/push/{n}"
+
+
+class PushHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, comme un vrai service push
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        with self.server.lock:
+            self.server.received += 1
+        self.send_response(201)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def browser_keys():
+    """Clés d'abonnement d'un navigateur (p256dh, auth), pour que le chiffrement soit réel."""
+    b64 = lambda raw: base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+    public = ec.generate_private_key(ec.SECP256R1()).public_key().public_bytes(
+        serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint)
+    return b64(public), b64(os.urandom(16))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Charge ingestion + /stream + push sur une base temporaire.")
+    parser.add_argument("--rate", type=float, default=20, help="événements envoyés par seconde")
+    parser.add_argument("--duration", type=float, default=10, help="durée de l'envoi (s)")
+    parser.add_argument("--senders", type=int, default=8, help="requêtes d'ingestion simultanées au plus")
+    parser.add_argument("--streams", type=int, default=10, help="clients /stream connectés")
+    parser.add_argument("--subscribers", type=int, default=5, help="abonnements push (vers le faux service)")
+    parser.add_argument("--push-delay", type=float, default=0.0, help="temps de réponse du faux service push (s)")
+    parser.add_argument("--push-window", type=float, default=None,
+                        help="fenêtre de regroupement des notifications (s ; défaut : celle du serveur)")
+    parser.add_argument("--types", default="bell,intrus_bruit", help="types d'événements envoyés, à tour de rôle")
+    parser.add_argument("--rate-limit", action="store_true", help="garder la limitation par sonnette (429)")
+    parser.add_argument("--json", metavar="FICHIER", help="écrit aussi les résultats en JSON (suivi des régressions)")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench-sonnette-")
+    db_path = os.path.join(tmp, "bench.db")
+    os.environ["DATABASE_URL"] = "sqlite:///" + db_path
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+    import app as server
+
+    if not args.rate_limit:
+        # Une seule sonnette bien plus bavarde qu'en vrai : on mesure le serveur, pas la limite
+        server.ingest_limiter.rate = server.ingest_limiter.burst = 1e9
+    if args.push_window is not None:
+        server.notif_coalescer.window = args.push_window
+    server.STREAM_HEARTBEAT = 1  # les clients /stream voient vite la fin du test
+
+    push = PushStub(args.push_delay)
+    threading.Thread(target=push.serve_forever, daemon=True).start()
+    with server.app.app_context():
+        for n in range(args.subscribers):
+            p256dh, auth = browser_keys()
+            server.db.session.add(server.PushSubscription(endpoint=push.endpoint(n), p256dh=p256dh, auth=auth))
+        server.db.session.commit()
+
+    types = args.types.split(",")
+    total = int(args.rate * args.duration)
+    sent_at = {}            # heure locale affichée -> début de la requête
+    latencies, lateness, statuses = [], [], {}
+    deliveries = [[] for _ in range(args.streams)]  # délais sonnette -> client, par client
+    dropped = [0]
+    finished = threading.Event()
+    next_index = [0]
+    lock = threading.Lock()
+
+    def stream_client(n):
+        client = server.app.test_client()
+        with client.session_transaction() as session:
+            session["logged_in"] = True
+        response = client.get("/stream", buffered=False)
+        messages = iter(response.response)
+        next(messages)  # instantané initial
+        connected.release()
+        for message in messages:
+            received = time.perf_counter()
+            message = message.decode() if isinstance(message, bytes) else message
+            if message.startswith("event: delta"):
+                data = json.loads(message.split("data: ", 1)[1])
+                stamps = data["bell_events"] + [evt["timestamp"] for evt in data["intrus_events"]]
+                deliveries[n].extend(received - sent_at[stamp] for stamp in stamps if stamp in sent_at)
+            if finished.is_set() and (len(deliveries[n]) >= statuses.get(200, 0) or message.startswith(":")):
+                # Tout est arrivé, ou file vide depuis STREAM_HEARTBEAT
+                break
+        else:
+            # Fin du flux côté serveur avant la fin du test : client jugé trop lent
+            dropped[0] += 1
+        response.close()
+
+    def sender():
+        client = server.app.test_client()
+        while True:
+            with lock:
+                i = next_index[0]
+                next_index[0] += 1
+            if i >= total:
+                return
+            delay = t0 + i / args.rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            ts = BASE_TS + timedelta(seconds=i)
+            body = {"secret": server.SECRET_KEY, "id": uuid.uuid4().hex,
+                    "type": types[i % len(types)], "timestamp": ts.isoformat()}
+            start = time.perf_counter()
+            sent_at[server.to_local(ts)] = start
+            r = client.post("/api/sonnette", json=body)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                lateness.append(max(0.0, start - (t0 + i / args.rate)))
+                statuses[r.status_code] = statuses.get(r.status_code, 0) + 1
+
+    connected = threading.Semaphore(0)
+    streams = [threading.Thread(target=stream_client, args=(n,), daemon=True) for n in range(args.streams)]
+    for t in streams:
+        t.start()
+    for _ in streams:
+        connected.acquire()
+
+    size_before = db_size(db_path)
+    senders = [threading.Thread(target=sender) for _ in range(args.senders)]
+    t0 = time.perf_counter()
+    for t in senders:
+        t.start()
+    for t in senders:
+        t.join()
+    wall = time.perf_counter() - t0
+    finished.set()
+    for t in streams:
+        t.join(timeout=5)
+    # Laisse le temps aux notifications en file de partir
+    deadline = time.monotonic() + 5
+    while server.push_dispatcher.stats()["queue_depth"] and time.monotonic() < deadline:
+        time.sleep(0.05)
+    size_after = db_size(db_path)
+
+    delays = [d for per_client in deliveries for d in per_client]
+    expected = statuses.get(200, 0) * args.streams
+    push_stats = server.push_dispatcher.stats()
+    results = {
+        "events": len(latencies),
+        "target_rate": args.rate,
+        "throughput": round(len(latencies) / wall, 1),
+        "statuses": {str(code): count for code, count in sorted(statuses.items())},
+        "ingest_p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "ingest_p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "send_lateness_p99_ms": round(percentile(lateness, 99) * 1000, 2),
+        "streams": args.streams,
+        "stream_dropped": dropped[0],
+        "sse_delivered": len(delays),
+        "sse_expected": expected,
+        "sse_p50_ms": round(percentile(delays, 50) * 1000, 2),
+        "sse_p99_ms": round(percentile(delays, 99) * 1000, 2),
+        "push_received": push.received,
+        "push_failed": push_stats["failed"],
+        "push_latency_avg_ms": push_stats["latency_avg_ms"],
+        "push_latency_max_ms": push_stats["latency_max_ms"],
+        "db_growth_bytes": size_after - size_before,
+        "db_bytes_per_event": round((size_after - size_before) / max(1, statuses.get(200, 0))),
+    }
+
+    print(f"ingestion : {results['events']} événements en {wall:.2f} s = {results['throughput']} év/s "
+          f"(demandé {args.rate:g}), réponses {results['statuses']}, "
+          f"p50 {results['ingest_p50_ms']} ms, p99 {results['ingest_p99_ms']} ms, "
+          f"retard d'envoi p99 {results['send_lateness_p99_ms']} ms")
+    print(f"/stream : {args.streams} clients, {len(delays)}/{expected} livraisons, "
+          f"délai p50 {results['sse_p50_ms']} ms, p99 {results['sse_p99_ms']} ms, {dropped[0]} décrochés")
+    print(f"push : {push.received} notifications reçues par le faux service ({args.subscribers} abonnés), "
+          f"{push_stats['failed']} échecs, latence moy. {push_stats['latency_avg_ms']} ms, "
+          f"max {push_stats['latency_max_ms']} ms")
+    print(f"base : +{results['db_growth_bytes'] / 1024:.0f} Kio ({results['db_bytes_per_event']} o/événement enregistré, "
+          f"base + WAL)")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    push.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# Diffusion en mémoire des événements vers les clients /stream (Server-Sent Events).
+#
+# receive_sonnette publie une seule fois par événement ; chaque onglet connecté
+# possède sa propre file bornée. Un client trop lent (file pleine) est déconnecté
+# au lieu de bloquer l'éditeur : le navigateur se reconnecte tout seul
+# (EventSource) et repart d'un instantané neuf.
+
+import json
+import queue
+import threading
+
+
+class Subscription:
+    def __init__(self, maxsize, topic=None):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.topic = topic  # None : reçoit tout
+        self.dropped = False
+
+    def messages(self, heartbeat):
+        """Génère les messages SSE en attente, ou None après `heartbeat` secondes d'inactivité."""
+        while not self.dropped:
+            try:
+                yield self.queue.get(timeout=heartbeat)
+            except queue.Empty:
+                yield None
+
+
+class EventBroker:
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self, topic=None):
+        sub = Subscription(self.queue_size, topic)
+        with self._lock:
+            self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def publish(self, data, event=None, topic=None):
+        """Sérialise `data` une seule fois et le pousse dans la file de chaque abonné.
+
+        Seuls les abonnés de ce sujet et ceux sans sujet (qui reçoivent tout) le
+        reçoivent : un message sans sujet ne va qu'aux abonnés sans sujet.
+        """
+        message = format_sse(data, event)
+        with self._lock:
+            subscribers = [sub for sub in self._subscribers if sub.topic is None or sub.topic == topic]
+        for sub in subscribers:
+            try:
+                sub.queue.put_nowait(message)
+            except queue.Full:
+                # Consommateur trop lent : on le lâche plutôt que d'attendre
+                sub.dropped = True
+                self.unsubscribe(sub)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._subscribers)
+
+
+class SnapshotCache:
+    """Dernier instantané produit par `build()`, gardé sérialisé jusqu'à `invalidate()`.
+
+    Les pages et les connexions /stream qui arrivent entre deux événements
+    réutilisent le même objet sans requête. Un numéro de génération empêche
+    un calcul commencé avant une invalidation d'être mis en cache après elle.
+    Cache propre au processus, comme le broker.
+    """
+
+    def __init__(self, build):
+        self.build = build
+        self._snapshot = None
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.builds = 0
+
+    def get(self):
+        """(données, JSON, message SSE) de l'instantané courant."""
+        with self._lock:
+            if self._snapshot is not None:
+                return self._snapshot
+            generation = self._generation
+        data = self.build()
+        text = json.dumps(data)
+        # JSON aussi injecté tel quel dans un <script> (index.html)
+        snapshot = (data, text.replace("</", "<\\/"), f"data: {text}\n\n")
+        with self._lock:
+            self.builds += 1
+            if generation == self._generation:
+                self._snapshot = snapshot
+        return snapshot
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._snapshot = None
+
+
+def format_sse(data, event=None):
+    payload = f"data: {json.dumps(data)}\n\n"
+    if event:
+        payload = f"event: {event}\n" + payload
+    return payload
@@ -0,0 +1,142 @@
+# Canal d'ingestion UDP : un datagramme binaire signé par événement, acquitté
+# par un datagramme signé. Optionnel (UDP_INGEST_PORT) ; la sonnette retombe sur
+# HTTP (/api/sonnette/batch) si l'acquittement n'arrive pas.
+#
+# Événement (56 octets) : "SN1" | appareil u32 | seq u64 | horodatage UTC f64 | type u8 | uid 16 o | HMAC 16 o
+# Acquittement (28 octets) : "SA1" | seq u64 | statut u8 | HMAC 16 o
+# HMAC = HMAC-SHA256 tronqué du reste du datagramme, avec la clé de l'appareil
+# (appareil 0 : secret global des anciennes sonnettes).
+#
+# Anti-rejeu : seq est une horloge en microsecondes strictement croissante côté
+# sonnette. Un seq trop éloigné de l'heure du serveur, ou déjà vu dans la
+# fenêtre de l'appareil, est refusé ; l'uid garde de toute façon l'ingestion
+# idempotente.
+
+import hashlib
+import hmac
+import socket
+import struct
+import threading
+import time
+
+MAGIC_EVENT = b"SN1"
+MAGIC_ACK = b"SA1"
+EVENT_FORMAT = struct.Struct("!3sIQdB16s")
+ACK_FORMAT = struct.Struct("!3sQB")
+MAC_SIZE = 16
+
+# Codes de type : à garder identiques dans sonnnette/datagram.py
+TYPE_CODES = {1: "bell", 2: "intrus_bruit", 3: "intrus_presence", 4: "intrus_presence_et_bruit", 5: "intrus"}
+
+CREATED, DUPLICATE, REJECTED, REPLAYED, RATE_LIMITED = range(5)
+
+
+def sign(key, data):
+    return hmac.new(key, data, hashlib.sha256).digest()[:MAC_SIZE]
+
+
+def decode_event(key_for, datagram):
+    """(appareil, seq, horodatage, type, uid) d'un datagramme authentique ; ValueError sinon.
+
+    `key_for(appareil)` renvoie la clé HMAC de l'appareil, ou None s'il est inconnu.
+    """
+    if len(datagram) != EVENT_FORMAT.size + MAC_SIZE:
+        raise ValueError("bad size")
+    body, mac = datagram[:-MAC_SIZE], datagram[-MAC_SIZE:]
+    magic, device, seq, ts, code, uid = EVENT_FORMAT.unpack(body)
+    key = key_for(device) if magic == MAGIC_EVENT else None
+    if key is None:
+        raise ValueError("bad header")
+    if not hmac.compare_digest(sign(key, body), mac):
+        raise ValueError("bad signature")
+    if code not in TYPE_CODES:
+        raise ValueError("bad type")
+    return device, seq, ts, TYPE_CODES[code], uid.hex()
+
+
+def encode_ack(key, seq, status):
+    body = ACK_FORMAT.pack(MAGIC_ACK, seq, status)
+    return body + sign(key, body)
+
+
+class ReplayWindow:
+    """Numéros de séquence déjà vus sur les `window` dernières secondes.
+
+    seq est en microsecondes d'horloge de la sonnette : il doit être à moins de
+    `max_skew` secondes de l'heure du serveur, ce qui écarte les vieux datagrammes
+    capturés même après un redémarrage du serveur.
+    """
+
+    def __init__(self, window=10.0, max_skew=120.0):
+        self.window = int(window * 1e6)
+        self.max_skew = int(max_skew * 1e6)
+        self.highest = 0
+        self.seen = set()
+
+    def accept(self, seq, now=None):
+        now_us = int((time.time() if now is None else now) * 1e6)
+        if abs(seq - now_us) > self.max_skew or seq <= self.highest - self.window or seq in self.seen:
+            return False
+        self.seen.add(seq)
+        if seq > self.highest:
+            self.highest = seq
+            self.seen = {s for s in self.seen if s > seq - self.window}
+        return True
+
+
+class DatagramListener:
+    """Reçoit les datagrammes, appelle `handle(appareil, type, horodatage, uid)` -> statut, et acquitte."""
+
+    def __init__(self, host, port, key_for, handle):
+        self.address = (host, port)
+        self.key_for = key_for
+        self.handle = handle
+        self.windows = {}  # appareil -> ReplayWindow
+        self.sock = None
+        self._lock = threading.Lock()
+        self._started = False
+        self.counters = {"received": 0, "invalid": 0, "replayed": 0}
+
+    def ensure_started(self):
+        # Démarrage paresseux, comme PushDispatcher : le port n'est pris que par
+        # le processus qui sert les requêtes, pas par ceux qui importent app
+        # (flask archive-events, add-device, bench…)
+        if self._started:
+            return
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                sock.bind(self.address)
+            except OSError as e:
+                # Port déjà pris : la sonnette retombe sur HTTP, le site reste servi
+                sock.close()
+                print("Canal UDP indisponible:", e)
+                return
+            self.sock = sock
+            threading.Thread(target=self.run, name="udp-ingest", daemon=True).start()
+
+    def run(self):
+        while True:
+            datagram, addr = self.sock.recvfrom(512)
+            self.counters["received"] += 1
+            try:
+                device, seq, ts, evt_type, uid = decode_event(self.key_for, datagram)
+            except ValueError:
+                # Pas de réponse à un datagramme non authentifié
+                self.counters["invalid"] += 1
+                continue
+            key = self.key_for(device)
+            if not self.windows.setdefault(device, ReplayWindow()).accept(seq):
+                self.counters["replayed"] += 1
+                status = REPLAYED
+            else:
+                try:
+                    status = self.handle(device, evt_type, ts, uid)
+                except Exception as e:
+                    # Pas d'acquittement : la sonnette repassera par HTTP
+                    print("Erreur ingestion UDP:", e)
+                    continue
+            self.sock.sendto(encode_ack(key, seq, status), addr)
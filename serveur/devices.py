@@ -0,0 +1,68 @@
+# Cache mémoire des clés des sonnettes (table devices).
+#
+# Chaque événement reçu est authentifié par la clé de sa sonnette : la table
+# est chargée entière en mémoire et relue périodiquement (ajout, rotation ou
+# retrait d'une clé par `flask add-device` depuis un autre processus), jamais
+# à chaque requête. Un identifiant inconnu déclenche au plus un rechargement
+# toutes les `min_reload` secondes, pour qu'un flot de requêtes invalides ne
+# retombe pas sur la base.
+
+import hmac
+import threading
+import time
+
+
+class DeviceKeys:
+    def __init__(self, load, ttl=60.0, min_reload=5.0, clock=time.monotonic):
+        self.load = load          # () -> {id: (nom, clé)}
+        self.ttl = ttl
+        self.min_reload = min_reload
+        self.clock = clock
+        self._keys = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self.reloads = 0
+
+    def _reload(self, stale_after):
+        with self._lock:
+            # Un autre thread vient peut-être de recharger pendant l'attente du verrou
+            if self._loaded_at is not None and self.clock() - self._loaded_at < stale_after:
+                return
+            self._keys = self.load()
+            self._loaded_at = self.clock()
+            self.reloads += 1
+
+    def refresh(self):
+        """Recharge la table si elle a plus de `ttl` secondes ; renvoie son âge avant rechargement."""
+        age = None if self._loaded_at is None else self.clock() - self._loaded_at
+        if age is None or age > self.ttl:
+            self._reload(self.ttl)
+        return age
+
+    def get(self, device_id):
+        """(nom, clé) de la sonnette, ou None si inconnue."""
+        age = self.refresh()
+        # Pas rechargée à l'instant : un identifiant inconnu peut être une sonnette ajoutée depuis
+        if age is not None and self.min_reload < age <= self.ttl and device_id not in self._keys:
+            self._reload(self.min_reload)
+        return self._keys.get(device_id)
+
+    def verify(self, device_id, secret):
+        entry = self.get(device_id)
+        if entry is None or not isinstance(secret, str):
+            return False
+        return hmac.compare_digest(secret.encode(), entry[1].encode())
+
+    def name(self, device_id):
+        entry = self.get(device_id)
+        return entry[0] if entry else None
+
+    def all(self):
+        """{id: nom} de toutes les sonnettes connues."""
+        # Pas de get(None) : None n'est jamais une clé et forcerait un rechargement
+        self.refresh()
+        return {device_id: name for device_id, (name, key) in self._keys.items()}
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
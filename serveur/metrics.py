@@ -0,0 +1,133 @@
+# Métriques au format texte Prometheus, sans dépendance.
+#
+# Compteurs, jauges (lues au moment de la collecte) et histogrammes à seaux
+# fixes. Une observation = un bisect et deux additions sous un verrou, de
+# l'ordre de la microseconde : les décorateurs de chronométrage peuvent rester
+# actifs en production.
+
+import bisect
+import threading
+import time
+from functools import wraps
+
+# Seaux par défaut (secondes) : de la milliseconde (commit SQLite) à la dizaine
+# de secondes (envoi push qui expire)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for k, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, registry, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, registry, name, help, labelnames=()):
+        super().__init__(registry, name, help, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{format_labels(self.labelnames, labels)} {value}" for labels, value in values]
+
+
+class Gauge(Metric):
+    """Valeur lue au moment de la collecte : `read()` renvoie la valeur, ou {labels: valeur}.
+
+    kind="counter" pour exposer un compteur tenu ailleurs (PushDispatcher.counters…).
+    """
+    kind = "gauge"
+
+    def __init__(self, registry, name, help, read, labelnames=(), kind="gauge"):
+        super().__init__(registry, name, help, labelnames)
+        self.read = read
+        self.kind = kind
+
+    def render(self):
+        value = self.read()
+        if not isinstance(value, dict):
+            value = {(): value}
+        return [f"{self.name}{format_labels(self.labelnames, labels)} {v}" for labels, v in sorted(value.items())]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, registry, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, help, labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [compte par seau (+Inf en dernier), somme]
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def time(self, *labels):
+        """Décorateur : chronomètre chaque appel de la fonction."""
+        def decorator(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return f(*args, **kwargs)
+                finally:
+                    self.observe(time.perf_counter() - start, *labels)
+            return wrapper
+        return decorator
+
+    def render(self):
+        with self._lock:
+            series = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._series.items())
+        lines = []
+        for labels, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{format_labels(self.labelnames, labels, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.header())
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
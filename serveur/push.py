@@ -0,0 +1,183 @@
+# File d'envoi des notifications Web Push en arrière-plan.
+#
+# La requête d'ingestion se contente de mettre les envois en file ; un pool de
+# workers les transmet en parallèle aux services push. Les erreurs transitoires
+# (réseau, 429, 5xx) sont réessayées avec un délai exponentiel, les abonnements
+# expirés (404/410) sont signalés via `on_gone` pour être supprimés.
+
+import queue
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from py_vapid import Vapid
+from pywebpush import WebPusher, WebPushException
+
+GONE_STATUS = (404, 410)
+VAPID_TTL = 12 * 60 * 60      # [secondes] Durée de validité d'un JWT VAPID (max autorisé : 24 h)
+VAPID_RENEW_MARGIN = 60 * 60  # [secondes] On re-signe quand il reste moins que ça
+
+
+def push_origin(endpoint):
+    url = urlparse(endpoint)
+    return f"{url.scheme}://{url.netloc}"
+
+
+class PushSender:
+    """Envoi d'une notification, avec signature VAPID et session HTTP mises en cache par origine.
+
+    La clé privée est décodée une seule fois ; l'en-tête Authorization ne dépend
+    que de l'origine du service push (claim `aud`), il est donc signé une fois
+    par origine et réutilisé jusqu'à l'approche de son expiration. Le chiffrement
+    du contenu reste propre à chaque abonné (clés ECDH du navigateur).
+    """
+
+    def __init__(self, private_key, claims, timeout=10, pool_size=4):
+        self.vapid = Vapid.from_string(private_key=private_key)
+        self.claims = dict(claims)
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._headers = {}    # origine -> (en-têtes VAPID, expiration)
+        self._sessions = {}   # origine -> requests.Session
+        self._lock = threading.Lock()
+        self.signatures = 0
+
+    def vapid_headers(self, origin):
+        now = time.time()
+        with self._lock:
+            cached = self._headers.get(origin)
+            if cached and cached[1] - now > VAPID_RENEW_MARGIN:
+                return cached[0]
+            exp = int(now) + VAPID_TTL
+            headers = self.vapid.sign(dict(self.claims, aud=origin, exp=exp))
+            self._headers[origin] = (headers, exp)
+            self.signatures += 1
+            return headers
+
+    def session(self, origin):
+        with self._lock:
+            session = self._sessions.get(origin)
+            if session is None:
+                session = requests.Session()
+                session.mount(origin, HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size))
+                self._sessions[origin] = session
+            return session
+
+    def __call__(self, subscription, payload):
+        origin = push_origin(subscription["endpoint"])
+        response = WebPusher(subscription, requests_session=self.session(origin)).send(
+            payload,
+            dict(self.vapid_headers(origin)),
+            timeout=self.timeout,
+        )
+        if response.status_code > 202:
+            raise WebPushException(
+                f"Push failed: {response.status_code} {response.reason}",
+                response=response,
+            )
+        return response
+
+
+class PushDispatcher:
+    def __init__(self, send, on_gone=None, workers=4, max_retries=3, backoff=1.0, on_latency=None):
+        self.send = send
+        self.on_gone = on_gone
+        self.on_latency = on_latency  # Appelé avec la durée (s) de chaque envoi réussi (métriques)
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = False
+        self._retrying = 0
+        self.counters = {"sent": 0, "failed": 0, "retried": 0, "pruned": 0}
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+    def submit(self, subscription, payload):
+        self._ensure_started()
+        self._queue.put((subscription, payload, 0))
+
+    def _ensure_started(self):
+        # Démarrage paresseux : les workers naissent dans le processus qui sert
+        # les requêtes (après le fork de gunicorn), pas à l'import.
+        with self._lock:
+            if self._started:
+                return
+            for i in range(self.workers):
+                threading.Thread(target=self._worker, name=f"push-{i}", daemon=True).start()
+            self._started = True
+
+    def _worker(self):
+        while True:
+            subscription, payload, attempt = self._queue.get()
+            try:
+                self._deliver(subscription, payload, attempt)
+            except Exception as e:
+                print("Erreur push:", e)
+                self._count("failed")
+            finally:
+                self._queue.task_done()
+
+    def _deliver(self, subscription, payload, attempt):
+        start = time.perf_counter()
+        try:
+            self.send(subscription, payload)
+        except WebPushException as e:
+            status = e.response.status_code if e.response is not None else None
+            if status in GONE_STATUS:
+                self._count("pruned")
+                if self.on_gone:
+                    self.on_gone(subscription)
+            elif status is None or status == 429 or status >= 500:
+                self._retry(subscription, payload, attempt, e)
+            else:
+                print("Erreur push:", e)
+                self._count("failed")
+            return
+        except requests.RequestException as e:
+            self._retry(subscription, payload, attempt, e)
+            return
+        latency = time.perf_counter() - start
+        with self._lock:
+            self.counters["sent"] += 1
+            self._latency_total += latency
+            self._latency_max = max(self._latency_max, latency)
+        if self.on_latency:
+            self.on_latency(latency)
+
+    def _retry(self, subscription, payload, attempt, error):
+        if attempt >= self.max_retries:
+            print("Erreur push (abandon):", error)
+            self._count("failed")
+            return
+        self._count("retried")
+        delay = self.backoff * (2 ** attempt)
+        with self._lock:
+            self._retrying += 1
+
+        def requeue():
+            with self._lock:
+                self._retrying -= 1
+            self._queue.put((subscription, payload, attempt + 1))
+
+        timer = threading.Timer(delay, requeue)
+        timer.daemon = True
+        timer.start()
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def stats(self):
+        with self._lock:
+            sent = self.counters["sent"]
+            return dict(
+                self.counters,
+                queue_depth=self._queue.qsize(),
+                retrying=self._retrying,
+                latency_avg_ms=round(1000 * self._latency_total / sent, 1) if sent else None,
+                latency_max_ms=round(1000 * self._latency_max, 1),
+            )
@@ -0,0 +1,91 @@
+# Protection côté serveur contre une sonnette trop bavarde (défaillante ou
+# compromise) : l'anti-spam du client (NOTIF_COOLDOWN, COOLDOWN_BELL) ne suffit
+# pas à borner le coût des envois push.
+#
+# - RateLimiter : seau à jetons par clé (sonnette, type d'événement) ; une
+#   requête sans jeton est refusée (429) et la sonnette la garde dans sa file.
+# - NotificationCoalescer : la première notification d'une rafale part tout de
+#   suite, les suivantes sont résumées en une seule à la fin de la fenêtre.
+
+import threading
+import time
+
+
+class RateLimiter:
+    """Seaux à jetons : `burst` jetons au plus, rechargés à `rate` jetons par seconde."""
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self._buckets = {}  # clé -> (jetons, instant de la dernière mise à jour)
+        self._lock = threading.Lock()
+        self.limited = 0
+
+    def acquire(self, keys):
+        """Prend un jeton pour chacune des `keys` (ou {clé: jetons}), tout ou rien.
+
+        Renvoie 0 si c'est accordé, sinon le délai (s) avant que tous les jetons
+        soient disponibles ; rien n'est alors consommé. Un coût supérieur à
+        `burst` est ramené à `burst` (sinon jamais accordé).
+        """
+        costs = keys if isinstance(keys, dict) else dict.fromkeys(keys, 1)
+        now = self.clock()
+        with self._lock:
+            levels = {}
+            for key in costs:
+                tokens, last = self._buckets.get(key, (self.burst, now))
+                levels[key] = min(self.burst, tokens + (now - last) * self.rate)
+            missing = max((min(costs[key], self.burst) - tokens for key, tokens in levels.items()), default=0)
+            if missing > 0:
+                self.limited += 1
+                return missing / self.rate
+            for key, tokens in levels.items():
+                self._buckets[key] = (tokens - min(costs[key], self.burst), now)
+            return 0
+
+
+class NotificationCoalescer:
+    """Regroupe les notifications d'une même clé sur une fenêtre de `window` secondes.
+
+    `send(clé, nombre, résumé)` est appelé tout de suite pour le premier lot
+    d'une rafale (résumé=False), puis à la fin de chaque fenêtre où d'autres
+    événements sont arrivés (résumé=True, nombre = événements regroupés). Une
+    fenêtre sans événement referme la rafale.
+    """
+
+    def __init__(self, send, window=30.0):
+        self.send = send
+        self.window = window
+        self._pending = {}  # clé -> événements arrivés depuis le dernier envoi (fenêtre ouverte)
+        self._lock = threading.Lock()
+        self.counters = {"sent": 0, "coalesced": 0}
+
+    def submit(self, key, count=1):
+        with self._lock:
+            if key in self._pending:
+                self._pending[key] += count
+                self.counters["coalesced"] += count
+                return
+            self._pending[key] = 0
+            self.counters["sent"] += 1
+        self._schedule(key)
+        self.send(key, count, False)
+
+    def _schedule(self, key):
+        timer = threading.Timer(self.window, self._close, (key,))
+        timer.daemon = True
+        timer.start()
+
+    def _close(self, key):
+        with self._lock:
+            count = self._pending.pop(key)
+            if count:
+                self._pending[key] = 0  # le résumé rouvre une fenêtre
+                self.counters["sent"] += 1
+        if count:
+            self._schedule(key)
+            try:
+                self.send(key, count, True)
+            except Exception as e:
+                print("Erreur notification groupée:", e)
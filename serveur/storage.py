@@ -0,0 +1,113 @@
+# Réglages SQLite et écrivain unique pour les événements.
+#
+# Sous gunicorn + gevent, de nombreux lecteurs (/stream, /admin) cohabitent avec
+# les écritures de la sonnette. En mode WAL les lecteurs ne bloquent plus
+# l'écrivain (et inversement) ; les écritures d'un même processus passent par un
+# seul thread qui regroupe les requêtes en attente dans une seule transaction
+# (« group commit ») au lieu d'un COMMIT + fsync par requête.
+
+import queue
+import threading
+from concurrent.futures import Future
+
+from sqlalchemy import event
+
+
+def sqlite_engine_options(pool_size=10, max_overflow=20, pool_timeout=10, busy_timeout=5.0):
+    """Options moteur pour SQLALCHEMY_ENGINE_OPTIONS.
+
+    Chaque greenlet gevent qui touche la base prend une connexion du pool :
+    `pool_size` connexions restent ouvertes, `max_overflow` de plus au besoin,
+    et une requête attend au plus `pool_timeout` secondes avant d'échouer.
+    """
+    return {
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": pool_timeout,
+        "connect_args": {"timeout": busy_timeout, "check_same_thread": False},
+    }
+
+
+def install_pragmas(engine, busy_timeout_ms=5000, cache_kib=8192):
+    """Applique les PRAGMA à chaque nouvelle connexion du pool.
+
+    - journal_mode=WAL : lectures concurrentes pendant une écriture (persistant dans le fichier) ;
+    - synchronous=NORMAL : pas de fsync par commit en WAL, seulement aux checkpoints ;
+      un crash de l'application ne perd rien, une coupure de courant peut perdre
+      les dernières transactions (la sonnette les renvoie, l'ingestion est idempotente) ;
+    - busy_timeout : attente du verrou d'écriture au lieu d'un « database is locked » immédiat ;
+    - cache_size : cache de pages par connexion, en Kio.
+    """
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={int(busy_timeout_ms)}")
+        cursor.execute(f"PRAGMA cache_size=-{int(cache_kib)}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+
+class WriteBatcher:
+    """Thread écrivain unique : regroupe les écritures en attente en une seule transaction.
+
+    `write(jobs)` reçoit la liste des travaux accumulés (au plus `max_batch`) et
+    renvoie la liste des résultats dans le même ordre ; il est appelé depuis le
+    seul thread écrivain. `submit(job)` renvoie un Future résolu après le commit.
+    """
+
+    def __init__(self, write, max_batch=200):
+        self.write = write
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = False
+        self.batches = 0
+        self.jobs = 0
+
+    def submit(self, job):
+        self._ensure_started()
+        future = Future()
+        self._queue.put((job, future))
+        return future
+
+    def _ensure_started(self):
+        # Même principe que PushDispatcher : thread créé après le fork de gunicorn
+        with self._lock:
+            if not self._started:
+                threading.Thread(target=self._run, name="db-writer", daemon=True).start()
+                self._started = True
+
+    def _run(self):
+        while True:
+            pending = [self._queue.get()]
+            while len(pending) < self.max_batch:
+                try:
+                    pending.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                results = self.write([job for job, future in pending])
+            except Exception as e:
+                if len(pending) == 1:
+                    pending[0][1].set_exception(e)
+                else:
+                    # Un travail invalide ne doit pas faire échouer les autres :
+                    # chacun est rejoué seul, seul le fautif reçoit l'erreur
+                    for job, future in pending:
+                        self._run_alone(job, future)
+            else:
+                for (job, future), result in zip(pending, results):
+                    future.set_result(result)
+            self.batches += 1
+            self.jobs += len(pending)
+
+    def _run_alone(self, job, future):
+        try:
+            future.set_result(self.write([job])[0])
+        except Exception as e:
+            future.set_exception(e)
+
+    def stats(self):
+        return {"batches": self.batches, "jobs": self.jobs, "queue_depth": self._queue.qsize()}
@@ -0,0 +1,223 @@
+# Chaîne de détection de bruit, indépendante du matériel : acquisition cadencée
+# (la lecture de l'ADC est injectée) et détection sur fenêtres glissantes.
+#
+# Coût constant par échantillon : la somme de la fenêtre courante et le nombre
+# de fenêtres sous le seuil sont tenus à jour au fil de l'eau, au lieu de
+# recalculer sum(buffer) et all(moyennes) à chaque lecture.
+
+import json
+import os
+import time
+from collections import deque, namedtuple
+
+import numpy as np
+
+V_REF = 0.01  # [volts] Référence du niveau en dB (même convention que test/sound_sensor/micro.py)
+
+# Descripteurs d'un bloc : niveau efficace, niveau relatif, crête, taux de passage
+# par zéro (autour de la moyenne du bloc) et variance de l'énergie à court terme.
+Features = namedtuple("Features", "rms db peak zcr energy_var")
+
+
+class NoiseWindowDetector:
+    """Lève `bruit` quand toutes les fenêtres couvrant `duree_detection` ont une moyenne > `seuil`.
+
+    - fenetre : durée d'une fenêtre de moyenne (s)
+    - periode : intervalle entre deux échantillons (s)
+    - hop : décalage entre deux fenêtres évaluées (s) ; par défaut = fenetre
+      (fenêtres jointives), plus petit pour des fenêtres qui se chevauchent.
+    """
+
+    def __init__(self, seuil, duree_detection, fenetre, periode, hop=None, model=None):
+        self.seuil = seuil
+        self.model = model  # BackgroundModel optionnel : le seuil suit alors le bruit de fond
+        self.window = max(1, round(fenetre / periode))
+        self.hop = max(1, round((hop or fenetre) / periode))
+        self.nb_windows = max(1, round((duree_detection - fenetre) / (self.hop * periode)) + 1)
+        self.reset()
+
+    def reset(self):
+        self.ring = [0.0] * self.window
+        self.pos = 0
+        self.filled = 0
+        self.total = 0.0
+        self.countdown = self.window          # échantillons avant la prochaine fenêtre évaluée
+        self.decisions = deque(maxlen=self.nb_windows)  # True = fenêtre sous le seuil
+        self.nb_below = 0
+        self.bruit = False
+
+    def push(self, v):
+        """Ajoute un échantillon (déjà en valeur absolue) et renvoie l'état `bruit`."""
+        old = self.ring[self.pos]
+        self.ring[self.pos] = v
+        self.total += v - old
+        self.pos += 1
+        if self.pos == self.window:
+            self.pos = 0
+            # Recalcul exact une fois par tour pour éviter la dérive des flottants (O(1) amorti)
+            self.total = sum(self.ring)
+        if self.filled < self.window:
+            self.filled += 1
+
+        self.countdown -= 1
+        if self.countdown == 0:
+            self.countdown = self.hop
+            self._add_window(self.total / self.window)
+        return self.bruit
+
+    def _add_window(self, moyenne):
+        below = moyenne <= self.seuil
+        if self.model is not None:
+            self.model.update(moyenne, bruit=not below)
+            self.seuil = self.model.threshold()
+        if len(self.decisions) == self.nb_windows:
+            self.nb_below -= self.decisions[0]
+        self.decisions.append(below)
+        self.nb_below += below
+        self.bruit = len(self.decisions) == self.nb_windows and self.nb_below == 0
+
+    def push_block(self, block):
+        for v in np.abs(block).tolist():
+            self.push(v)
+        return self.bruit
+
+
+class BackgroundModel:
+    """Modèle en ligne du bruit de fond : moyenne et variance exponentielles du niveau des fenêtres.
+
+    Le seuil vaut moyenne + k écarts-types (borné par `seuil_min`). Les fenêtres
+    au-dessus du seuil n'entrent dans le modèle qu'avec un poids réduit, pour
+    qu'un bruit prolongé ne devienne pas le nouveau « calme » en quelques
+    secondes. Tant que `warmup` fenêtres n'ont pas été vues, `seuil_initial`
+    s'applique ; un modèle rechargé depuis le disque est utilisable d'emblée.
+    """
+
+    def __init__(self, seuil_initial, alpha=0.005, k=4.0, seuil_min=0.0, warmup=50):
+        self.seuil_initial = seuil_initial
+        self.alpha = alpha
+        self.k = k
+        self.seuil_min = seuil_min
+        self.warmup = warmup
+        self.mean = None
+        self.var = 0.0
+        self.n = 0
+
+    def update(self, level, bruit=False):
+        if self.mean is None:
+            self.mean = level
+        alpha = self.alpha * (0.1 if bruit else 1.0)
+        diff = level - self.mean
+        incr = alpha * diff
+        self.mean += incr
+        self.var = (1 - alpha) * (self.var + diff * incr)
+        self.n += 1
+
+    def threshold(self):
+        if self.n < self.warmup:
+            return self.seuil_initial
+        return max(self.seuil_min, self.mean + self.k * self.var ** 0.5)
+
+    def save(self, path):
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"mean": self.mean, "var": self.var, "n": self.n, "saved_at": time.time()}, f)
+        os.replace(tmp, path)  # écriture atomique
+
+    def load(self, path):
+        """Recharge un modèle sauvegardé ; False si absent ou illisible."""
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            self.mean, self.var, self.n = float(data["mean"]), float(data["var"]), int(data["n"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+        return True
+
+
+def block_features(blocks, v_ref=V_REF, sub_windows=4):
+    """Descripteurs vectorisés d'un bloc (1D) ou d'une pile de blocs (2D, un bloc par ligne).
+
+    Tout est calculé par NumPy sur l'axe des échantillons, sans boucle Python
+    par échantillon ; avec une pile, chaque champ de Features est un tableau.
+    """
+    x = np.asarray(blocks, dtype=np.float32)
+    rms = np.sqrt(np.mean(x * x, axis=-1))
+    db = 20 * np.log10(np.maximum(rms, v_ref) / v_ref)
+    peak = np.max(np.abs(x), axis=-1)
+    centered = x - x.mean(axis=-1, keepdims=True)
+    signs = np.signbit(centered)
+    zcr = np.mean(signs[..., 1:] != signs[..., :-1], axis=-1)
+    # Énergie par sous-fenêtre (échantillons en trop ignorés), puis sa variance
+    n = x.shape[-1] // sub_windows * sub_windows
+    sub = x[..., :n].reshape(x.shape[:-1] + (sub_windows, -1))
+    energy_var = np.var(np.mean(sub * sub, axis=-1), axis=-1)
+    return Features(rms, db, peak, zcr, energy_var)
+
+
+def classify(features, db_calme=0.0, crete_impulsif=3.0, cv_impulsif=1.0):
+    """Classe un bloc : "calme", "impulsif" (claquement, choc) ou "continu" (voix, circulation)."""
+    if features.db <= db_calme:
+        return "calme"
+    energy = max(float(features.rms) ** 2, 1e-12)
+    crest = float(features.peak) / max(float(features.rms), 1e-9)
+    if crest > crete_impulsif or np.sqrt(features.energy_var) / energy > cv_impulsif:
+        return "impulsif"
+    return "continu"
+
+
+class AdcAcquisition:
+    """Échantillonnage cadencé d'une voie ADC dans un tampon circulaire préalloué.
+
+    `read` renvoie une tension (AnalogIn.voltage en mode conversion continue :
+    simple lecture du registre, pas de conversion déclenchée). Les échantillons
+    sont lus sur un échéancier fixe (pas de dérive liée au temps de lecture I2C)
+    et remis par blocs de `block_size` à `on_block`. Un retard de plus d'une
+    période est compté en échantillons perdus plutôt que rattrapé en rafale.
+    """
+
+    def __init__(self, read, rate, block_size, capacity=None, clock=time.perf_counter):
+        self.read = read
+        self.period = 1.0 / rate
+        self.block_size = block_size
+        self.ring = np.zeros(capacity or block_size * 16, dtype=np.float32)
+        self.clock = clock
+        self.written = 0       # total d'échantillons écrits
+        self.delivered = 0     # total d'échantillons remis au consommateur
+        self.dropped = 0
+        self.started_at = None
+
+    def run(self, on_block, stop):
+        self.started_at = next_t = self.clock()
+        capacity = len(self.ring)
+        while not stop.is_set():
+            delay = next_t - self.clock()
+            if delay > 0:
+                if stop.wait(delay):
+                    break
+            elif delay < -self.period:
+                missed = int(-delay / self.period)
+                self.dropped += missed
+                next_t += missed * self.period
+            self.ring[self.written % capacity] = self.read()
+            self.written += 1
+            next_t += self.period
+            if self.written - self.delivered >= self.block_size:
+                on_block(self.last(self.block_size))
+                self.delivered = self.written
+
+    def last(self, n):
+        """Copie des `n` derniers échantillons, du plus ancien au plus récent."""
+        capacity = len(self.ring)
+        end = self.written % capacity
+        if end >= n:
+            return self.ring[end - n:end].copy()
+        return np.concatenate((self.ring[capacity - (n - end):], self.ring[:end]))
+
+    def measured_rate(self):
+        if self.started_at is None:
+            return 0.0
+        elapsed = self.clock() - self.started_at
+        return self.written / elapsed if elapsed > 0 else 0.0
+
+    def stats(self):
+        return {"rate": round(self.measured_rate(), 1), "samples": self.written, "dropped": self.dropped}
@@ -1,15 +1,23 @@
 #!/usr/bin/env python3
 
-import RPi.GPIO as GPIO
 import time
+T_DEMARRAGE = time.perf_counter()
+
+import os
+import uuid
+import sqlite3
 import requests
-from datetime import datetime
+from requests.adapters import HTTPAdapter
+from datetime import datetime, timezone
+from contextlib import contextmanager
 import threading
+import queue
 from collections import deque
-import board
-import busio
-import adafruit_ads1x15.ads1115 as ADS
-from adafruit_ads1x15.analog_in import AnalogIn
+from datagram import REJECTED, DatagramChannel
+from bruit import AdcAcquisition, BackgroundModel, NoiseWindowDetector, block_features, classify
+from hal import GpioHal, open_noise_channel
+from intrusion import IntrusionEngine, run
+from telemetry import Telemetry, setup_logging
 
 # === CONFIGURATION PRINCIPALE ===
 
@@ -19,215 +27,547 @@ PIR_PIN = 20              # [GPIO] Broche GPIO du capteur de mouvement PIR
 
 COOLDOWN_BELL = 2         # [secondes] Temps anti-spam entre deux sonnettes (appuis bouton)
 SERVER_URL = "https://smartsonnette.duckdns.org//api/sonnette"  # [URL] Adresse de l'API serveur
-SECRET_KEY = "super_secret"         # [str] Clé secrète pour authentification API
+BATCH_URL = SERVER_URL + "/batch"   # [URL] Envoi groupé des événements en attente
+PING_URL = "https://smartsonnette.duckdns.org/api/ping"         # [URL] Requête légère pour ouvrir/tester la connexion
+SECRET_KEY = "super_secret"         # [str] Clé secrète pour authentification API (clé de la sonnette si DEVICE_ID)
+DEVICE_ID = None                    # [nombre] Identifiant donné par `flask add-device` ; None = secret global du serveur
+UDP_HOST = "smartsonnette.duckdns.org"  # [hôte] Canal UDP signé du serveur (UDP_INGEST_PORT côté serveur)
+UDP_PORT = None                     # [port] None = canal UDP désactivé, tout passe par HTTP
+UDP_ACK_TIMEOUT = 0.3               # [secondes] Attente des acquittements UDP avant repli sur HTTP
+UDP_MAX_EVENTS = 10                 # [nombre] Au-delà (rattrapage après coupure), envoi groupé HTTP directement
 
 ALERT_TIMEOUT = 20        # [secondes] Délai avant confirmation "intrus" si pas de sonnette
-MIN_HIGH_STREAK = 8       # [nombre] Nombre de détections HIGH (mouvement) PIR nécessaires pour armer l’alerte
-MIN_LOW_STREAK = 4        # [nombre] Nombre de détections LOW PIR consécutives pour réarmer le système
+MIN_HIGH_DURATION = 8.0   # [secondes] Durée de PIR HIGH (mouvement) continu nécessaire pour armer l’alerte
+MIN_LOW_DURATION = 4.0    # [secondes] Durée de PIR LOW continu nécessaire pour réarmer le système
+PIR_SETTLE = 3.0          # [secondes] PIR LOW stable pendant cette durée = capteur prêt après la mise sous tension
+PIR_WARMUP_MAX = 20.0     # [secondes] Durée max du préchauffage PIR (ancienne calibration fixe)
+DEBOUNCE_MS = 50          # [millisecondes] Anti-rebond matériel (bouncetime) des interruptions GPIO
+DEBOUNCE_CONFIRM = 0.005  # [secondes] Délai avant relecture du bouton pour confirmer l'appui (anti-rebond logiciel)
 
 # === CONFIGURATION DÉTECTION BRUIT ===
 
-SEUIL_BRUIT = 0.0040          # [volts] Seuil de tension pour considérer qu’un bruit est détecté (ADC)
+SEUIL_BRUIT = 0.0040          # [volts] Seuil de tension pour considérer qu’un bruit est détecté (ADC) ; seuil de départ si SEUIL_ADAPTATIF
+SEUIL_ADAPTATIF = True        # [bool] Le seuil suit le bruit de fond mesuré (moyenne + SEUIL_K écarts-types)
+SEUIL_K = 4.0                 # [nombre] Écarts-types au-dessus du bruit de fond pour parler de bruit
+SEUIL_ALPHA = 0.005           # [0-1] Vitesse d'adaptation du modèle de fond (par fenêtre ; 0.005 ≈ 40 s)
+SEUIL_MIN = 0.0010            # [volts] Seuil plancher, même dans un silence parfait
+MODELE_BRUIT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bruit_fond.json")  # [fichier] Modèle de fond conservé entre deux démarrages
+MODELE_BRUIT_SAVE = 300       # [secondes] Intervalle de sauvegarde du modèle de fond
 DUREE_DETECTION_BRUIT = 2.0   # [secondes] Durée pendant laquelle le bruit doit être détecté en continu
 FENETRE_BRUIT = 0.2           # [secondes] Fenêtre de temps utilisée pour la moyenne glissante sur la détection de bruit
 REFRESH_BRUIT = 0.02          # [secondes] Intervalle de lecture du capteur de bruit (fréquence d'échantillonnage ADC)
+HOP_BRUIT = None              # [secondes] Décalage entre deux fenêtres évaluées (None = FENETRE_BRUIT, fenêtres jointives)
+ADC_DATA_RATE = 128           # [échantillons/s] Cadence de conversion continue de l'ADS1115 (8, 16, 32, 64, 128, 250, 475, 860)
+BLOC_BRUIT = 10               # [nombre] Échantillons remis d'un coup au détecteur
+BRUIT_V_REF = 0.001           # [volts] Référence du niveau en dB des descripteurs audio
+BRUIT_DB_CALME = 0.0          # [dB] Niveau sous lequel un bloc est classé "calme"
+BRUIT_CLASSES_ALERTE = None   # [tuple] Classes de bloc ("impulsif", "continu") qui valident un intrus_bruit ; None = pas de filtre
+
+# === FILE D'ENVOI HORS-LIGNE ===
+
+OUTBOX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "outbox.db")  # [fichier] Événements en attente d'envoi (survit aux redémarrages)
+OUTBOX_MAX = 5000             # [nombre] Taille max de la file ; au-delà, les plus anciens sont supprimés
+OUTBOX_BATCH = 100            # [nombre] Événements max envoyés par requête
+SEND_TIMEOUT = 3              # [secondes] Timeout d'un envoi au serveur
+SEND_BACKOFF_MIN = 1.0        # [secondes] Attente après un premier échec d'envoi
+SEND_BACKOFF_MAX = 60.0       # [secondes] Attente max entre deux tentatives (backoff exponentiel)
+KEEPALIVE_INTERVAL = 45.0     # [secondes] Ping du serveur quand rien n'est envoyé, pour garder la connexion TLS ouverte
 
 # === ANTI-SPAM NOTIFICATIONS ===
 
 NOTIF_COOLDOWN = 30.0         # [secondes] Temps minimum entre deux notifications envoyées du même type (anti-spam général)
 
-GPIO.setwarnings(False)
-GPIO.setmode(GPIO.BCM)
-GPIO.setup(SPEAKER_PIN, GPIO.OUT)
-GPIO.setup(TOUCH_PIN, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-GPIO.setup(PIR_PIN, GPIO.IN)
-pwm = GPIO.PWM(SPEAKER_PIN, 1000)
+# === ENREGISTREMENT DE TRACE (rejouable avec replay.py) ===
+
+TRACE_PATH = os.environ.get("SONNETTE_TRACE")  # [fichier] Si défini, chaque événement capteur y est ajouté (JSONL)
+
+# === TÉLÉMÉTRIE ET JOURNAL ===
+
+TELEMETRY_URL = "https://smartsonnette.duckdns.org/api/telemetry"  # [URL] Réception des résumés de télémétrie
+TELEMETRY_INTERVAL = 300.0    # [secondes] Période d'envoi du résumé (durées de boucle, cadence ADC, latence d'envoi)
+LOG_LEVEL = os.environ.get("SONNETTE_LOG_LEVEL", "INFO")  # [DEBUG/INFO/WARNING] Niveau du journal console
+
+logger, log_listener = setup_logging(LOG_LEVEL)
+telemetry = Telemetry(TELEMETRY_INTERVAL)
+
+# --- Chronométrage du démarrage ---
+DEMARRAGE = [("imports", time.perf_counter() - T_DEMARRAGE)]  # (étape, durée en s)
+
+@contextmanager
+def etape_demarrage(nom):
+    t = time.perf_counter()
+    yield
+    DEMARRAGE.append((nom, time.perf_counter() - t))
+
+with etape_demarrage("GPIO"):
+    hal = GpioHal(SPEAKER_PIN, TOUCH_PIN, PIR_PIN, DEBOUNCE_MS, DEBOUNCE_CONFIRM)
+
+# --- Mélodies ---
+NOTES = {
+    'C4': 262, 'E4': 330, 'G#4': 415, 'A4': 440, 'B4': 494,
+    'C5': 523, 'D5': 587, 'D#5': 622, 'E5': 659, 'G5': 784,
+    'C6': 1046,
+    'PAUSE': 0
+}
+
+MELODIE_SONNETTE = [('C5', 0.2), ('E5', 0.2), ('G5', 0.2), ('C6', 0.3)]
+
+# Lettre à Élise (version simplifiée, cf. test/speaker3.py)
+MELODIE_ELISE = [
+    ('E5', 0.3), ('D#5', 0.3), ('E5', 0.3), ('D#5', 0.3),
+    ('E5', 0.3), ('B4', 0.3), ('D5', 0.3), ('C5', 0.3),
+    ('A4', 0.6),
+    ('PAUSE', 0.3),
+    ('C4', 0.3), ('E4', 0.3), ('A4', 0.3), ('B4', 0.6),
+    ('PAUSE', 0.3),
+    ('E4', 0.3), ('G#4', 0.3), ('B4', 0.3), ('C5', 0.6)
+]
+
+# --- Thread audio : joue les mélodies sans bloquer la boucle principale ---
+class AudioPlayer(threading.Thread):
+    def __init__(self, pwm):
+        super().__init__(daemon=True)
+        self.pwm = pwm
+        self.commands = queue.Queue()
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    def play(self, melody, preempt=True):
+        """Met `melody` (liste de (note, durée)) en file ; avec preempt, coupe ce qui est en cours."""
+        with self._lock:
+            if preempt:
+                self._drain()
+                self._cancel.set()
+            self.commands.put(melody)
+
+    def cancel(self):
+        with self._lock:
+            self._drain()
+            self._cancel.set()
+
+    def _drain(self):
+        try:
+            while True:
+                self.commands.get_nowait()
+        except queue.Empty:
+            pass
+
+    def run(self):
+        while True:
+            melody = self.commands.get()
+            if melody is None:
+                break
+            with self._lock:
+                self._cancel.clear()
+            for note, dur in melody:
+                freq = NOTES.get(note, 0) if isinstance(note, str) else note
+                if freq:
+                    self.pwm.ChangeFrequency(freq)
+                    self.pwm.start(50)
+                interrupted = self._cancel.wait(dur)
+                self.pwm.stop()
+                if interrupted or self._cancel.wait(0.05):
+                    break
+
+    def stop(self):
+        self.cancel()
+        self.commands.put(None)
+
+player = AudioPlayer(hal.pwm)
 
 def play_bip():
-    melody = [(523, 0.2), (659, 0.2), (784, 0.2), (1046, 0.3)]
-    for freq, dur in melody:
-        pwm.ChangeFrequency(freq)
-        pwm.start(50)
-        time.sleep(dur)
-        pwm.stop()
-        time.sleep(0.05)
+    player.play(MELODIE_SONNETTE)
+
+# --- File d'envoi persistante (SQLite) ---
+class EventOutbox:
+    def __init__(self, path, max_size):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=FULL")  # une coupure de courant ne doit pas perdre d'événement
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, uid TEXT NOT NULL, "
+            "type TEXT NOT NULL, timestamp TEXT NOT NULL)"
+        )
+        self.conn.commit()
+
+    def put(self, evt_type):
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO outbox (uid, type, timestamp) VALUES (?, ?, ?)",
+                (uuid.uuid4().hex, evt_type, datetime.utcnow().isoformat()),
+            )
+            # File pleine : on sacrifie les plus anciens
+            self.conn.execute(
+                "DELETE FROM outbox WHERE seq <= "
+                "(SELECT seq FROM outbox ORDER BY seq DESC LIMIT 1 OFFSET ?)",
+                (self.max_size,),
+            )
+
+    def peek(self, limit):
+        # Sonneries d'abord : un visiteur n'attend pas derrière un rattrapage d'alertes
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT uid, type, timestamp FROM outbox ORDER BY type = 'bell' DESC, seq LIMIT ?", (limit,)
+            ).fetchall()
+        return [{"id": uid, "type": evt_type, "timestamp": ts} for uid, evt_type, ts in rows]
+
+    def remove(self, uids):
+        with self._lock, self.conn:
+            self.conn.executemany("DELETE FROM outbox WHERE uid = ?", [(uid,) for uid in uids])
+
+    def __len__(self):
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+# --- Session HTTP persistante (keep-alive) vers le serveur ---
+class TrackingAdapter(HTTPAdapter):
+    # Retient le pool urllib3 utilisé par la dernière requête (pour compter les connexions ouvertes)
+    last_pool = None
+
+    def get_connection_with_tls_context(self, *args, **kwargs):  # requests >= 2.32
+        self.last_pool = super().get_connection_with_tls_context(*args, **kwargs)
+        return self.last_pool
+
+    def get_connection(self, *args, **kwargs):  # requests < 2.32 (paquet de la distribution)
+        self.last_pool = super().get_connection(*args, **kwargs)
+        return self.last_pool
+
+class ServerSession:
+    """Garde une connexion TLS ouverte vers le serveur et mesure le coût de la poignée de main.
+
+    Chaque envoi est classé « à froid » (nouvelle connexion TCP+TLS ouverte) ou
+    « à chaud » (connexion réutilisée) ; la différence des moyennes donne le
+    temps passé dans la poignée de main.
+    """
+
+    def __init__(self):
+        self.session = None
+        self.stats = {"froid": [0, 0.0], "chaud": [0, 0.0]}  # type -> [nombre, durée totale]
+        self.reset()
+
+    def reset(self):
+        if self.session is not None:
+            self.session.close()
+        self.session = requests.Session()
+        self.adapter = TrackingAdapter(pool_connections=1, pool_maxsize=2, max_retries=0)
+        self.connections = 0
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+
+    def request(self, method, url, **kwargs):
+        start = time.perf_counter()
+        try:
+            r = self.session.request(method, url, timeout=SEND_TIMEOUT, **kwargs)
+        except requests.ConnectionError:
+            # Connexion morte (coupure réseau, serveur redémarré) : on repart de zéro
+            self.reset()
+            raise
+        elapsed = time.perf_counter() - start
+        pool = self.adapter.last_pool
+        if pool is None:
+            # Pool introuvable (version de requests inattendue) : envoi réussi, sans classement
+            return r, "inconnue", elapsed
+        opened = pool.num_connections
+        kind = "froid" if opened > self.connections else "chaud"
+        self.connections = opened
+        self.stats[kind][0] += 1
+        self.stats[kind][1] += elapsed
+        return r, kind, elapsed
+
+    def warm_up(self):
+        """Ouvre la connexion à l'avance ; False si le serveur est injoignable."""
+        try:
+            r, kind, elapsed = self.request("GET", PING_URL)
+        except Exception as e:
+            logger.warning(f"Serveur injoignable : {e}")
+            return False
+        return r.ok
+
+    def summary(self):
+        moyennes = {k: (total / n if n else None) for k, (n, total) in self.stats.items()}
+        handshake = None
+        if moyennes["froid"] is not None and moyennes["chaud"] is not None:
+            handshake = max(0.0, moyennes["froid"] - moyennes["chaud"])
+        return moyennes, handshake
+
+def event_age(evt):
+    """Secondes écoulées depuis l'horodatage (UTC) de l'événement : attente en file + envoi."""
+    ts = datetime.fromisoformat(evt["timestamp"]).replace(tzinfo=timezone.utc).timestamp()
+    return max(0.0, time.time() - ts)
+
+# --- Thread d'envoi : vide la file par lots, avec backoff exponentiel en cas d'échec ---
+class EventSender(threading.Thread):
+    def __init__(self, outbox, server, datagrams=None):
+        super().__init__(daemon=True)
+        self.outbox = outbox
+        self.server = server
+        self.datagrams = datagrams  # DatagramChannel optionnel, essayé avant HTTP
+        self.backoff = SEND_BACKOFF_MIN
+        self._wake = threading.Event()
+        self._stop_flag = threading.Event()
+
+    def wake(self):
+        self._wake.set()
+
+    def run(self):
+        self.server.warm_up()
+        while not self._stop_flag.is_set():
+            try:
+                if telemetry.due():
+                    self.send_telemetry()
+                batch = self.outbox.peek(OUTBOX_BATCH)
+                if not batch:
+                    # Rien à envoyer : ping périodique pour garder la connexion chaude
+                    if not self._wake.wait(KEEPALIVE_INTERVAL):
+                        self.server.warm_up()
+                    self._wake.clear()
+                    continue
+                sent = self.flush(batch)
+            except Exception as e:
+                # Seul thread d'envoi : une erreur imprévue (réponse inattendue,
+                # file SQLite…) ne doit pas le tuer, on réessaie plus tard
+                logger.warning(f"Erreur inattendue du thread d'envoi : {e!r}")
+                sent = False
+            if sent:
+                self.backoff = SEND_BACKOFF_MIN
+            else:
+                # Un nouvel événement écourte l'attente : une sonnerie passe devant les
+                # types limités par le serveur (429)
+                self._wake.wait(self.backoff)
+                self._wake.clear()
+                self.backoff = min(self.backoff * 2, SEND_BACKOFF_MAX)
+
+    def flush(self, batch):
+        if self.datagrams is not None and len(batch) <= UDP_MAX_EVENTS:
+            batch = self.flush_udp(batch)
+            if not batch:
+                return True
+        payload = {"events": batch, "secret": SECRET_KEY}
+        if DEVICE_ID is not None:
+            payload["device"] = DEVICE_ID
+        try:
+            r, kind, elapsed = self.server.request("POST", BATCH_URL, json=payload)
+        except Exception as e:
+            logger.warning(f"Erreur réseau : {e} ({len(self.outbox)} événement(s) en attente)")
+            return False
+        if not r.ok:
+            logger.warning(f"Erreur serveur : {r.status_code}")
+            if r.status_code == 429:
+                # Limitation côté serveur : on attend au moins le délai demandé
+                self.backoff = max(self.backoff, float(r.headers.get("Retry-After", 0)))
+            return False
+        try:
+            results = r.json().get("results", [])
+        except (ValueError, AttributeError):
+            # 200 qui ne vient pas du serveur (proxy, portail captif) : on garde le lot
+            logger.warning(f"Réponse inattendue du serveur ({r.headers.get('Content-Type')})")
+            return False
+        # created / duplicate : reçu ; rejected : inutile de réessayer ; rate_limited : gardé
+        statuses = {res["id"]: res.get("status") for res in results if res.get("id")}
+        for res in results:
+            if res.get("status") == "rejected":
+                logger.warning(f"Événement {res.get('id')} refusé : {res.get('error')}")
+        self.outbox.remove(uid for uid, status in statuses.items() if status != "rate_limited")
+        telemetry.observe("envoi_http", elapsed)
+        for evt in batch:
+            if statuses.get(evt["id"]) in ("created", "duplicate"):
+                telemetry.observe("livraison", event_age(evt))
+                logger.info(f"Événement {evt['type']} envoyé ({elapsed * 1000:.0f} ms, connexion à {kind}).")
+        moyennes, handshake = self.server.summary()
+        if handshake is not None:
+            logger.debug(f"Moyennes : à froid {moyennes['froid'] * 1000:.0f} ms, à chaud {moyennes['chaud'] * 1000:.0f} ms "
+                         f"(poignée de main ≈ {handshake * 1000:.0f} ms)")
+        limited = sum(status == "rate_limited" for status in statuses.values())
+        if limited:
+            # Une partie du lot est limitée : on attend le délai demandé avant de la
+            # renvoyer, sauf si un nouvel événement arrive (une sonnerie passe devant)
+            logger.info(f"{limited} événement(s) limités par le serveur, nouvel essai plus tard")
+            self._wake.wait(float(r.json().get("retry_after", SEND_BACKOFF_MIN)))
+            self._wake.clear()
+        return True
+
+    def send_telemetry(self):
+        """Envoie le résumé de la période ; perdu en cas d'échec (pas de file pour la télémétrie)."""
+        payload = {"telemetry": telemetry.summary(), "secret": SECRET_KEY}
+        if DEVICE_ID is not None:
+            payload["device"] = DEVICE_ID
+        try:
+            r, kind, elapsed = self.server.request("POST", TELEMETRY_URL, json=payload)
+        except Exception as e:
+            logger.debug(f"Télémétrie non envoyée : {e}")
+            return
+        if not r.ok:
+            logger.debug(f"Télémétrie refusée : {r.status_code}")
+
+    def flush_udp(self, batch):
+        """Envoie le lot par UDP ; renvoie les événements non acquittés (à passer en HTTP)."""
+        start = time.perf_counter()
+        acks = self.datagrams.send(batch)
+        elapsed = time.perf_counter() - start
+        for uid, status in acks.items():
+            if status == REJECTED:
+                logger.warning(f"Événement {uid} refusé (UDP)")
+        self.outbox.remove(acks)
+        if acks:
+            telemetry.observe("envoi_udp", elapsed)
+        for evt in batch:
+            if acks.get(evt["id"], REJECTED) != REJECTED:
+                telemetry.observe("livraison", event_age(evt))
+                logger.info(f"Événement {evt['type']} envoyé ({elapsed * 1000:.0f} ms, UDP).")
+        return [evt for evt in batch if evt["id"] not in acks]
+
+    def stop(self):
+        self._stop_flag.set()
+        self._wake.set()
+
+with etape_demarrage("file d'envoi"):
+    outbox = EventOutbox(OUTBOX_PATH, OUTBOX_MAX)
+server = ServerSession()
+datagrams = DatagramChannel(UDP_HOST, UDP_PORT, SECRET_KEY.encode(), DEVICE_ID or 0, UDP_ACK_TIMEOUT) if UDP_PORT else None
+sender = EventSender(outbox, server, datagrams)
+telemetry.gauge("file_attente", outbox.__len__)
 
 def send_event(evt_type):
-    payload = {
-        "type": evt_type,
-        "timestamp": datetime.utcnow().isoformat(),
-        "secret": SECRET_KEY
-    }
-    try:
-        r = requests.post(SERVER_URL, json=payload, timeout=3)
-        if r.ok:
-            print(f"[{datetime.now().strftime('%H:%M:%S')}]  Événement {evt_type} envoyé.")
-        else:
-            #print(f"[DEBUG] Envoi event : {evt_type}")
-            print(f"[!]  Erreur serveur : {r.status_code}")
-    except Exception as e:
-        print(f"[!]  Erreur réseau : {e}")
+    # Instantané : l'événement est écrit sur disque, le thread d'envoi s'occupe du réseau
+    with telemetry.timer("file_ecriture"):
+        outbox.put(evt_type)
+    sender.wake()
 
 # --- Thread pour la détection de bruit ---
 class BruitDetector(threading.Thread):
-    def __init__(self, seuil, duree_detection, fenetre, refresh):
+    def __init__(self, seuil, duree_detection, fenetre, refresh, on_change=None, hop=None):
         super().__init__()
-        self.seuil = seuil
-        self.duree_detection = duree_detection
-        self.fenetre = fenetre
-        self.refresh = refresh
-        self.buffer_size = int(fenetre / refresh)
-        self.nb_moyennes = int(duree_detection / fenetre)
-        self.moyennes = deque([0]*self.nb_moyennes, maxlen=self.nb_moyennes)
-        self.buffer = deque([0]*self.buffer_size, maxlen=self.buffer_size)
+        self.on_change = on_change  # Appelé avec le nouvel état à chaque changement du flag bruit
+        self.model = None
+        if SEUIL_ADAPTATIF:
+            self.model = BackgroundModel(seuil, SEUIL_ALPHA, SEUIL_K, SEUIL_MIN)
+            if self.model.load(MODELE_BRUIT_PATH):
+                logger.info(f"Modèle de bruit de fond rechargé (seuil {self.model.threshold():.4f} V)")
+            self.last_save = time.time()
+        self.detector = NoiseWindowDetector(seuil, duree_detection, fenetre, refresh, hop, self.model)
+        if self.model is not None:
+            self.detector.seuil = self.model.threshold()
         self.bruit = False
         self._stop_flag = threading.Event()
-        # Init ADC
-        i2c = busio.I2C(board.SCL, board.SDA)
-        ads = ADS.ADS1115(i2c)
-        self.chan = AnalogIn(ads, ADS.P1)
+        # Init ADC (conversion continue) et acquisition cadencée à 1/refresh
+        chan = open_noise_channel(ADC_DATA_RATE)
+        self.acquisition = AdcAcquisition(lambda: chan.voltage, 1.0 / refresh, BLOC_BRUIT)
+        # Classes des blocs couvrant la durée de détection (filtre BRUIT_CLASSES_ALERTE)
+        self.accepted = deque(maxlen=max(1, round(duree_detection / (refresh * BLOC_BRUIT))))
+        self.nb_accepted = 0
+        self.last_features = None
+        self.last_class = None
 
     def run(self):
-        while not self._stop_flag.is_set():
-            v = abs(self.chan.voltage)
-            self.buffer.append(v)
-            if len(self.buffer) == self.buffer_size:
-                moyenne_fenetre = sum(self.buffer) / self.buffer_size
-                self.moyennes.append(moyenne_fenetre)
-                if all(m > self.seuil for m in self.moyennes):
-                    self.bruit = True
-                else:
-                    self.bruit = False
-            time.sleep(self.refresh)
+        self.acquisition.run(self._on_block, self._stop_flag)
+        self.save_model()
+
+    def save_model(self):
+        if self.model is not None and self.model.mean is not None:
+            self.model.save(MODELE_BRUIT_PATH)
+        self.last_save = time.time()
+
+    def _on_block(self, block):
+        start = time.perf_counter()
+        self.last_features = block_features(block, BRUIT_V_REF)
+        self.last_class = classify(self.last_features, BRUIT_DB_CALME)
+        bruit = self.detector.push_block(block)
+        if BRUIT_CLASSES_ALERTE is not None:
+            # Le bruit ne compte que si un bloc récent a le bon profil (ex. claquement de porte)
+            accepted = self.last_class in BRUIT_CLASSES_ALERTE
+            if len(self.accepted) == self.accepted.maxlen:
+                self.nb_accepted -= self.accepted[0]
+            self.accepted.append(accepted)
+            self.nb_accepted += accepted
+            bruit = bruit and self.nb_accepted > 0
+        if bruit != self.bruit:
+            self.bruit = bruit
+            if self.on_change:
+                self.on_change(bruit)
+        if self.model is not None and time.time() - self.last_save > MODELE_BRUIT_SAVE:
+            self.save_model()
+        telemetry.observe("bruit_bloc", time.perf_counter() - start)
 
     def stop(self):
         self._stop_flag.set()
 
+MELODIES = {
+    "sonnette": MELODIE_SONNETTE,
+    "elise": MELODIE_ELISE,
+}
+
+def log(t, msg):
+    # L'horodatage est ajouté par le journal, dans son propre thread
+    logger.info(msg)
+
+def handle_action(action):
+    kind, arg = action
+    if kind == "send":
+        send_event(arg)
+    elif kind == "play":
+        with telemetry.timer("audio_file"):
+            player.play(MELODIES[arg])
+
 def main_loop():
-    print("Calibration du capteur PIR... Merci de ne pas bouger devant le capteur.")
-    time.sleep(20)
-    print("Calibration terminée. Système prêt. Attente capteur et/ou bouton...")
-
-    last_bell = 0
-    high_streak = 0
-    low_streak = 0
-    surveillance = False
-    detection_time = 0
-    cycle_completed = False
-    last_pir_state = None  # Mémorise l’état PIR précédent
-
-    # --- Initialisation du détecteur de bruit ---
-    bruit_detector = BruitDetector(SEUIL_BRUIT, DUREE_DETECTION_BRUIT, FENETRE_BRUIT, REFRESH_BRUIT)
-    bruit_detector.daemon = True
-    bruit_detector.start()
-
-    # --- Système de verrou pour notifications (1 verrou pour chaque combinaison possible) ---
-    notif_locks = {
-        "intrus_bruit": 0,
-        "intrus_presence": 0,
-        "intrus_presence_et_bruit": 0
-    }
+    with etape_demarrage("threads"):
+        sender.start()
+        player.start()
+    if len(outbox):
+        logger.info(f"{len(outbox)} événement(s) en attente depuis le dernier arrêt, envoi en arrière-plan.")
+
+    # --- Machine à états (intrusion.py), alimentée par les événements GPIO horodatés ---
+    # Le PIR préchauffe en tâche de fond : bouton et sonnette sont actifs tout de suite.
+    with etape_demarrage("moteur"):
+        engine = IntrusionEngine(
+            min_high=MIN_HIGH_DURATION,
+            min_low=MIN_LOW_DURATION,
+            alert_timeout=ALERT_TIMEOUT,
+            cooldown_bell=COOLDOWN_BELL,
+            notif_cooldown=NOTIF_COOLDOWN,
+            t0=time.time(),
+            pir=hal.pir_state,
+            pir_ready=False,
+            log=log,
+        )
+        source = hal
+        if TRACE_PATH:
+            from replay import TraceRecorder
+            source = TraceRecorder(hal, TRACE_PATH, pir=hal.pir_state)
+            logger.info(f"Enregistrement de la trace capteurs dans {TRACE_PATH}")
+        hal.start()
+        hal.start_pir_warmup(PIR_SETTLE, PIR_WARMUP_MAX)
+
+    # --- Initialisation du détecteur de bruit (publie ses changements d'état comme événements) ---
+    with etape_demarrage("ADC"):
+        bruit_detector = BruitDetector(SEUIL_BRUIT, DUREE_DETECTION_BRUIT, FENETRE_BRUIT, REFRESH_BRUIT,
+                                       on_change=lambda bruit: hal.post("noise", bruit), hop=HOP_BRUIT)
+        bruit_detector.daemon = True
+        bruit_detector.start()
+        telemetry.gauge("adc_cadence", lambda: round(bruit_detector.acquisition.measured_rate(), 1))
+        telemetry.gauge("adc_perdus", lambda: bruit_detector.acquisition.dropped)
+        telemetry.gauge("seuil_bruit", lambda: round(bruit_detector.detector.seuil, 5))
+
+    total = time.perf_counter() - T_DEMARRAGE
+    detail = ", ".join(f"{nom} {duree * 1000:.0f} ms" for nom, duree in DEMARRAGE)
+    logger.info(f"Système prêt en {total * 1000:.0f} ms ({detail}). Préchauffage du PIR en arrière-plan (max {PIR_WARMUP_MAX:g}s).")
 
     try:
-        while True:
-            now = time.time()
-            pir_state = GPIO.input(PIR_PIN) == GPIO.HIGH
-            bell_pressed = GPIO.input(TOUCH_PIN) == GPIO.HIGH
-            bruit = bruit_detector.bruit
-
-            # === DEBUG : Affiche uniquement lors d'un changement d'état PIR ===
-            #if pir_state != last_pir_state:
-                #print(f"[{datetime.now().strftime('%H:%M:%S')}] [DEBUG] PIR passe {'HIGH (mouvement)' if pir_state else 'LOW (pas de mouvement)'}")
-                #last_pir_state = pir_state
-
-            # --- PHASE 1 : Attente de détection de présence (pas encore en surveillance) ---
-            if not surveillance and not cycle_completed:
-                if pir_state:
-                    high_streak += 1
-                    if high_streak <= MIN_HIGH_STREAK:
-                        restants = MIN_HIGH_STREAK - high_streak
-                        print(f"[{datetime.now().strftime('%H:%M:%S')}] PIR HIGH ({high_streak}/{MIN_HIGH_STREAK}) {'- Encore %d avant décompte!' % restants if restants > 0 else '- Séquence armée !'}")
-                    if high_streak == MIN_HIGH_STREAK:
-                        print(f"[{datetime.now().strftime('%H:%M:%S')}] === {MIN_HIGH_STREAK} HIGH consécutifs détectés : DÉBUT DU DÉCOMPTE ALERTE INTRUS ({ALERT_TIMEOUT}s) ===")
-                        surveillance = True
-                        detection_time = now
-                        low_streak = 0
-                else:
-                    if high_streak > 0:
-                        print(f"[{datetime.now().strftime('%H:%M:%S')}] PIR repasse LOW, reset du compteur HIGH.")
-                    high_streak = 0
-
-            # --- PHASE 2 : Surveillance (présence validée) ---
-            elif surveillance:
-                if now - detection_time > ALERT_TIMEOUT:
-                    print(f"[{datetime.now().strftime('%H:%M:%S')}] ⚠️ INTRUS détecté (pas de sonnette après {ALERT_TIMEOUT}s)")
-                    send_event("intrus")
-                    surveillance = False
-                    cycle_completed = True
-                    low_streak = 0
-                elif not pir_state:
-                    low_streak += 1
-                    if low_streak <= MIN_LOW_STREAK:
-                        restants = MIN_LOW_STREAK - low_streak
-                        print(f"[{datetime.now().strftime('%H:%M:%S')}] PIR LOW en surveillance ({low_streak}/{MIN_LOW_STREAK}) {'- Encore %d avant réarmement.' % restants if restants > 0 else '- Réarmement possible après événement.'}")
-                else:
-                    low_streak = 0
-
-            # --- PHASE 3 : Cycle complété, attente du réarmement (4 LOW) ---
-            elif cycle_completed:
-                if not pir_state:
-                    low_streak += 1
-                    if low_streak <= MIN_LOW_STREAK:
-                        restants = MIN_LOW_STREAK - low_streak
-                        print(f"[{datetime.now().strftime('%H:%M:%S')}] PIR LOW (réarmement) ({low_streak}/{MIN_LOW_STREAK}) {'- Encore %d avant système réarmé.' % restants if restants > 0 else '- SYSTÈME RÉARMÉ.'}")
-                    if low_streak == MIN_LOW_STREAK:
-                        print(f"[{datetime.now().strftime('%H:%M:%S')}] === {MIN_LOW_STREAK} LOW consécutifs détectés : SYSTÈME RÉARMÉ ===")
-                        cycle_completed = False
-                        high_streak = 0
-                        low_streak = 0
-                else:
-                    low_streak = 0
-
-            # --- GESTION SONNETTE ---
-            if bell_pressed and now - last_bell > COOLDOWN_BELL:
-                print(f"[{datetime.now().strftime('%H:%M:%S')}]  Bouton pressé")
-                play_bip()
-                if surveillance:
-                    send_event("bell")
-                    print(f"[{datetime.now().strftime('%H:%M:%S')}] Sonnerie pendant alerte : annulation du cycle alerte/intrus.")
-                    surveillance = False
-                    cycle_completed = True
-                    low_streak = 0
-                else:
-                    send_event("bell")
-                last_bell = now
-                while GPIO.input(TOUCH_PIN) == GPIO.HIGH:
-                    time.sleep(0.1)
-
-            # --- GESTION NOTIFICATION INTRUS (BRUIT &/OU MOUVEMENT) ---
-            notif_type = None
-            if bruit and pir_state:
-                notif_type = "intrus_presence_et_bruit"
-            elif bruit and not pir_state:
-                notif_type = "intrus_bruit"
-            elif pir_state and not bruit:
-                notif_type = "intrus_presence"
-
-            if notif_type:
-                last_sent = notif_locks[notif_type]
-                if now - last_sent > NOTIF_COOLDOWN:
-                    send_event(notif_type)
-                    notif_locks[notif_type] = now
-        
-
-
-            time.sleep(1)
+        run(engine, source, handle_action, observe=telemetry.observe)
 
     except KeyboardInterrupt:
-        print("Arrêt demandé, nettoyage GPIO...")
+        logger.info("Arrêt demandé, nettoyage GPIO...")
         bruit_detector.stop()
         bruit_detector.join()
-        GPIO.cleanup()
+        stats = bruit_detector.acquisition.stats()
+        logger.info(f"ADC : {stats['rate']} éch/s mesurés, {stats['samples']} lus, {stats['dropped']} perdus")
+        sender.stop()
+        player.stop()
+        player.join()
+        hal.cleanup()
+        log_listener.stop()
 
 if __name__ == '__main__':
     main_loop()
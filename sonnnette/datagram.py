@@ -0,0 +1,116 @@
+# Envoi des événements au serveur par datagrammes UDP signés (HMAC-SHA256),
+# avec acquittement : une aller-retour UDP au lieu d'une requête HTTPS.
+# Les événements non acquittés à temps repartent par HTTP (EventSender).
+#
+# Format : voir serveur/datagram.py (les deux côtés doivent rester identiques).
+
+import hashlib
+import hmac
+import socket
+import struct
+import threading
+import time
+from datetime import datetime, timezone
+
+MAGIC_EVENT = b"SN1"
+MAGIC_ACK = b"SA1"
+EVENT_FORMAT = struct.Struct("!3sIQdB16s")
+ACK_FORMAT = struct.Struct("!3sQB")
+MAC_SIZE = 16
+
+TYPE_CODES = {"bell": 1, "intrus_bruit": 2, "intrus_presence": 3, "intrus_presence_et_bruit": 4, "intrus": 5}
+
+CREATED, DUPLICATE, REJECTED, REPLAYED, RATE_LIMITED = range(5)
+
+
+def sign(key, data):
+    return hmac.new(key, data, hashlib.sha256).digest()[:MAC_SIZE]
+
+
+def encode_event(key, device, seq, evt):
+    ts = datetime.fromisoformat(evt["timestamp"]).replace(tzinfo=timezone.utc).timestamp()
+    body = EVENT_FORMAT.pack(MAGIC_EVENT, device, seq, ts, TYPE_CODES[evt["type"]], bytes.fromhex(evt["id"]))
+    return body + sign(key, body)
+
+
+def decode_ack(key, datagram):
+    """(seq, statut) d'un acquittement authentique ; ValueError sinon."""
+    if len(datagram) != ACK_FORMAT.size + MAC_SIZE:
+        raise ValueError("bad size")
+    body, mac = datagram[:-MAC_SIZE], datagram[-MAC_SIZE:]
+    if not hmac.compare_digest(sign(key, body), mac):
+        raise ValueError("bad signature")
+    magic, seq, status = ACK_FORMAT.unpack(body)
+    if magic != MAGIC_ACK:
+        raise ValueError("bad header")
+    return seq, status
+
+
+class DatagramChannel:
+    """Envoie un lot d'événements et attend leurs acquittements pendant au plus `timeout` secondes.
+
+    Le numéro de séquence est l'horloge en microsecondes, forcée strictement
+    croissante : pas d'état à conserver entre deux démarrages. `device` est
+    l'identifiant de la sonnette côté serveur (0 : secret global).
+    """
+
+    def __init__(self, host, port, key, device=0, timeout=0.3):
+        self.address = (host, port)
+        self.key = key
+        self.device = device
+        self.timeout = timeout
+        self.sock = None
+        self.last_seq = 0
+        self._lock = threading.Lock()
+
+    def _socket(self):
+        if self.sock is None:
+            # connect() : résolution DNS une seule fois, et seules les réponses du serveur sont reçues
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.connect(self.address)
+        return self.sock
+
+    def reset(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def _next_seq(self):
+        self.last_seq = max(self.last_seq + 1, time.time_ns() // 1000)
+        return self.last_seq
+
+    def send(self, events):
+        """Renvoie {uid: statut} des événements acquittés ; les autres sont à renvoyer par HTTP."""
+        with self._lock:
+            try:
+                return self._send(events)
+            except OSError:
+                self.reset()  # réseau changé, DNS… : nouvelle socket au prochain envoi
+                return {}
+
+    def _send(self, events):
+        sock = self._socket()
+        pending = {}
+        for evt in events:
+            if evt["type"] not in TYPE_CODES:
+                continue
+            seq = self._next_seq()
+            pending[seq] = evt["id"]
+            sock.send(encode_event(self.key, self.device, seq, evt))
+        acks = {}
+        deadline = time.monotonic() + self.timeout
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            sock.settimeout(remaining)
+            try:
+                seq, status = decode_ack(self.key, sock.recv(64))
+            except socket.timeout:
+                break
+            except ValueError:
+                continue
+            uid = pending.pop(seq, None)
+            if uid is not None and status in (CREATED, DUPLICATE, REJECTED):
+                acks[uid] = status
+        return acks
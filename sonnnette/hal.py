@@ -0,0 +1,104 @@
+# Couche d'accès au matériel du Raspberry Pi (GPIO, ADC ADS1115).
+#
+# Transforme les fronts GPIO en SensorEvent horodatés dans une file ; c'est la
+# seule partie du client qui dépend de RPi.GPIO et des bibliothèques Adafruit,
+# le moteur (intrusion.py) ne voit que des événements.
+
+import queue
+import threading
+import time
+
+import RPi.GPIO as GPIO
+import board
+import busio
+import adafruit_ads1x15.ads1115 as ADS
+from adafruit_ads1x15.ads1x15 import Mode
+from adafruit_ads1x15.analog_in import AnalogIn
+
+from intrusion import SensorEvent
+
+
+class GpioHal:
+    def __init__(self, speaker_pin, touch_pin, pir_pin, debounce_ms=50, debounce_confirm=0.005):
+        self.touch_pin = touch_pin
+        self.pir_pin = pir_pin
+        self.debounce_ms = debounce_ms
+        self.debounce_confirm = debounce_confirm
+        self.events = queue.Queue()
+
+        GPIO.setwarnings(False)
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setup(speaker_pin, GPIO.OUT)
+        GPIO.setup(touch_pin, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
+        GPIO.setup(pir_pin, GPIO.IN)
+        self.pwm = GPIO.PWM(speaker_pin, 1000)
+        self.pir_state = self.read_pir()
+
+    def read_pir(self):
+        return GPIO.input(self.pir_pin) == GPIO.HIGH
+
+    def start(self):
+        # Interruptions sur fronts plutôt que scrutation
+        GPIO.add_event_detect(self.touch_pin, GPIO.RISING, callback=self._on_touch, bouncetime=self.debounce_ms)
+        GPIO.add_event_detect(self.pir_pin, GPIO.BOTH, callback=self._on_pir, bouncetime=self.debounce_ms)
+
+    def start_pir_warmup(self, settle, max_wait, poll=0.1):
+        """Surveille le PIR en tâche de fond et publie "pir_ready" dès que son signal s'est stabilisé.
+
+        Prêt = LOW sans changement depuis `settle` secondes, ou au plus tard
+        après `max_wait` secondes. La valeur de l'événement est la durée du
+        préchauffage.
+        """
+        def watch():
+            start = last_change = time.time()
+            level = self.read_pir()
+            while True:
+                time.sleep(poll)
+                now = time.time()
+                current = self.read_pir()
+                if current != level:
+                    level, last_change = current, now
+                if (not level and now - last_change >= settle) or now - start >= max_wait:
+                    self.post("pir_ready", round(now - start, 1), now)
+                    return
+        threading.Thread(target=watch, name="pir-warmup", daemon=True).start()
+
+    def _on_touch(self, pin):
+        # Appelé depuis le thread RPi.GPIO : on confirme le niveau pour filtrer les parasites
+        t = time.time()
+        time.sleep(self.debounce_confirm)
+        if GPIO.input(pin) == GPIO.HIGH:
+            self.post("button", True, t)
+
+    def _on_pir(self, pin):
+        level = self.read_pir()
+        if level != self.pir_state:
+            self.pir_state = level
+            self.post("pir", level)
+
+    def post(self, kind, value, t=None):
+        """Injecte un événement (utilisé aussi par le détecteur de bruit)."""
+        self.events.put(SensorEvent(time.time() if t is None else t, kind, value))
+
+    def get(self, timeout):
+        """Prochain SensorEvent, ou None si rien avant `timeout` secondes."""
+        try:
+            return self.events.get(timeout=max(0.0, timeout))
+        except queue.Empty:
+            return None
+
+    def cleanup(self):
+        GPIO.cleanup()
+
+
+def open_noise_channel(data_rate=128):
+    """Voie A1 de l'ADS1115 (micro) en conversion continue à `data_rate` échantillons/s.
+
+    En mode continu, lire `voltage` ne fait que relire le dernier résultat de
+    conversion : pas d'attente de fin de conversion à chaque échantillon.
+    """
+    i2c = busio.I2C(board.SCL, board.SDA)
+    ads = ADS.ADS1115(i2c)
+    ads.data_rate = data_rate
+    ads.mode = Mode.CONTINUOUS
+    return AnalogIn(ads, ADS.P1)
@@ -0,0 +1,150 @@
+# Machine à états de détection d'intrus, indépendante du matériel.
+#
+# Le moteur reçoit des événements capteurs horodatés (PIR, bouton, bruit) et
+# renvoie les actions à effectuer (envoyer un événement, jouer une mélodie).
+# Les seuils sont des durées, pas des nombres d'itérations : le même moteur
+# tourne sur le Raspberry Pi (hal.py) ou en accéléré sur une trace enregistrée
+# (replay.py).
+
+import time
+from collections import namedtuple
+
+SensorEvent = namedtuple("SensorEvent", "t kind value")  # kind : "pir", "pir_ready", "button", "noise", "tick"
+
+ATTENTE = "attente"              # Pas de présence confirmée
+SURVEILLANCE = "surveillance"    # Présence confirmée, décompte avant alerte intrus
+CYCLE_TERMINE = "cycle_termine"  # Alerte envoyée ou visiteur qui a sonné : attente du réarmement
+
+NOTIF_TYPES = ("intrus_bruit", "intrus_presence", "intrus_presence_et_bruit")
+
+
+class IntrusionEngine:
+    def __init__(self, min_high=8.0, min_low=4.0, alert_timeout=20.0, cooldown_bell=2.0,
+                 notif_cooldown=30.0, t0=0.0, pir=False, pir_ready=True, log=None):
+        self.min_high = min_high              # PIR HIGH continu nécessaire pour armer l'alerte
+        self.min_low = min_low                # PIR LOW continu nécessaire pour réarmer
+        self.alert_timeout = alert_timeout    # Délai sans sonnette avant "intrus"
+        self.cooldown_bell = cooldown_bell
+        self.notif_cooldown = notif_cooldown
+        self.log = log or (lambda t, msg: None)
+
+        self.state = ATTENTE
+        self.pir = pir
+        self.pir_ready = pir_ready  # Tant que le PIR préchauffe, son signal est ignoré (le bouton marche déjà)
+        self.pir_since = t0       # Instant du dernier changement d'état PIR
+        self.bruit = False
+        self.detection_time = None
+        self.cycle_time = None    # Entrée dans CYCLE_TERMINE
+        self.last_bell = None
+        self.notif_locks = {notif_type: None for notif_type in NOTIF_TYPES}
+
+    def handle(self, evt):
+        """Traite un événement capteur et renvoie la liste des actions ("send"/"play", argument)."""
+        actions = []
+        if evt.kind == "pir":
+            if bool(evt.value) != self.pir:
+                self.pir = bool(evt.value)
+                self.pir_since = evt.t
+                if not self.pir and self.state == ATTENTE and self.pir_ready:
+                    self.log(evt.t, "PIR repasse LOW, reset du décompte HIGH.")
+        elif evt.kind == "pir_ready":
+            self.pir_ready = True
+            self.pir_since = evt.t
+            warmup = f" après {evt.value:g}s de préchauffage" if isinstance(evt.value, (int, float)) and not isinstance(evt.value, bool) else ""
+            self.log(evt.t, f"Capteur PIR prêt{warmup} : surveillance de présence active.")
+        elif evt.kind == "noise":
+            self.bruit = bool(evt.value)
+        elif evt.kind == "button":
+            self._bell(evt.t, actions)
+        self._update(evt.t, actions)
+        return actions
+
+    def _bell(self, t, actions):
+        if self.last_bell is not None and t - self.last_bell <= self.cooldown_bell:
+            return
+        self.log(t, "Bouton pressé")
+        actions.append(("send", "bell"))
+        actions.append(("play", "sonnette"))
+        if self.state == SURVEILLANCE:
+            self.log(t, "Sonnerie pendant alerte : annulation du cycle alerte/intrus.")
+            self._enter_cycle_termine(t)
+        self.last_bell = t
+
+    def _enter_cycle_termine(self, t):
+        self.state = CYCLE_TERMINE
+        self.cycle_time = t
+
+    def _presence(self):
+        return self.pir and self.pir_ready
+
+    def _update(self, t, actions):
+        if self.state == ATTENTE:
+            if self._presence() and t >= self.pir_since + self.min_high:
+                self.log(t, f"=== PIR HIGH depuis {self.min_high:g}s : DÉBUT DU DÉCOMPTE ALERTE INTRUS ({self.alert_timeout:g}s) ===")
+                self.state = SURVEILLANCE
+                self.detection_time = t
+        elif self.state == SURVEILLANCE:
+            if t >= self.detection_time + self.alert_timeout:
+                self.log(t, f"⚠️ INTRUS détecté (pas de sonnette après {self.alert_timeout:g}s)")
+                actions.append(("send", "intrus"))
+                self._enter_cycle_termine(t)
+        elif self.state == CYCLE_TERMINE:
+            if not self.pir and t >= max(self.pir_since, self.cycle_time) + self.min_low:
+                self.log(t, f"=== PIR LOW depuis {self.min_low:g}s : SYSTÈME RÉARMÉ ===")
+                self.state = ATTENTE
+
+        notif_type = self._notif_type()
+        if notif_type:
+            last_sent = self.notif_locks[notif_type]
+            if last_sent is None or t >= last_sent + self.notif_cooldown:
+                actions.append(("send", notif_type))
+                self.notif_locks[notif_type] = t
+
+    def _notif_type(self):
+        if self.bruit and self._presence():
+            return "intrus_presence_et_bruit"
+        if self.bruit:
+            return "intrus_bruit"
+        if self._presence():
+            return "intrus_presence"
+        return None
+
+    def next_deadline(self):
+        """Prochain instant où l'état peut changer sans nouvel événement (None s'il n'y en a pas)."""
+        deadlines = []
+        if self.state == ATTENTE and self._presence():
+            deadlines.append(self.pir_since + self.min_high)
+        elif self.state == SURVEILLANCE:
+            deadlines.append(self.detection_time + self.alert_timeout)
+        elif self.state == CYCLE_TERMINE and not self.pir:
+            deadlines.append(max(self.pir_since, self.cycle_time) + self.min_low)
+        notif_type = self._notif_type()
+        if notif_type and self.notif_locks[notif_type] is not None:
+            deadlines.append(self.notif_locks[notif_type] + self.notif_cooldown)
+        return min(deadlines) if deadlines else None
+
+
+def run(engine, source, on_action, clock=time.time, max_wait=5.0, observe=None):
+    """Boucle temps réel : attend le prochain événement de `source` ou la prochaine échéance du moteur.
+
+    `observe(nom, secondes)`, optionnel, reçoit les durées de la boucle :
+    "boucle_retard" (réveil après l'échéance), "evenement_attente" (capteur ->
+    traitement) et "moteur" (appel à handle).
+    """
+    while True:
+        deadline = engine.next_deadline()
+        timeout = max_wait if deadline is None else min(max_wait, deadline - clock())
+        evt = source.get(timeout)
+        now = clock()
+        if evt is None:
+            evt = SensorEvent(now, "tick", None)
+            if observe and deadline is not None and now >= deadline:
+                observe("boucle_retard", now - deadline)
+        elif observe:
+            observe("evenement_attente", max(0.0, now - evt.t))
+        start = time.perf_counter()
+        actions = engine.handle(evt)
+        if observe:
+            observe("moteur", time.perf_counter() - start)
+        for action in actions:
+            on_action(action)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# Rejoue une trace capteurs (PIR / bouton / bruit) dans le moteur d'intrusion,
+# sans matériel et plus vite que le temps réel.
+#
+# Format de trace (JSONL, une ligne par événement) :
+#   {"t": 1718570000.12, "kind": "pir", "value": true}
+# Les traces s'enregistrent sur le Pi avec SONNETTE_TRACE=/chemin/trace.jsonl.
+#
+# Exemples :
+#   python replay.py test/traces/presence_sans_sonnette.jsonl
+#   python replay.py trace.jsonl --expect trace.expected.jsonl   # régression
+#   python replay.py trace.jsonl --speed 10                      # 10x le temps réel
+#   python replay.py trace.jsonl --repeat 1000                   # benchmark de latence
+
+import argparse
+import json
+import sys
+import time
+
+from intrusion import IntrusionEngine, SensorEvent
+
+
+def load_trace(path):
+    with open(path) as f:
+        return [SensorEvent(d["t"], d["kind"], d.get("value")) for d in map(json.loads, filter(str.strip, f))]
+
+
+class TraceRecorder:
+    """Enveloppe une source d'événements (GpioHal) et écrit chaque événement reçu dans une trace."""
+
+    def __init__(self, source, path, pir=False):
+        self.source = source
+        self.file = open(path, "a", buffering=1)
+        self._write(SensorEvent(time.time(), "pir", pir))  # état initial
+
+    def _write(self, evt):
+        self.file.write(json.dumps(evt._asdict()) + "\n")
+
+    def get(self, timeout):
+        evt = self.source.get(timeout)
+        if evt is not None:
+            self._write(evt)
+        return evt
+
+
+def replay(events, speed=0.0, until=None, log=None):
+    """Rejoue `events` en temps virtuel.
+
+    Renvoie (actions, durées) : actions = [(t relatif, type, argument)],
+    durées = temps CPU de chaque appel au moteur, en secondes.
+    `speed` = 0 : aussi vite que possible ; sinon facteur d'accélération.
+    """
+    if not events:
+        return [], []
+    t0 = events[0].t
+    initial_pir = events[0].kind == "pir" and bool(events[0].value)
+    # Trace enregistrée pendant le préchauffage du PIR : même point de départ que sur le Pi
+    warming_up = any(evt.kind == "pir_ready" for evt in events)
+    engine = IntrusionEngine(t0=t0, pir=initial_pir, pir_ready=not warming_up, log=log)
+    actions, durations = [], []
+    wall_start, virtual = time.perf_counter(), t0
+
+    def step(evt):
+        nonlocal virtual
+        if speed > 0:
+            time.sleep(max(0.0, (evt.t - t0) / speed - (time.perf_counter() - wall_start)))
+        virtual = evt.t
+        start = time.perf_counter()
+        result = engine.handle(evt)
+        durations.append(time.perf_counter() - start)
+        actions.extend((round(evt.t - t0, 6), kind, arg) for kind, arg in result)
+
+    def ticks_until(t):
+        # Échéances internes du moteur (fin de décompte, réarmement…) avant l'instant t
+        while True:
+            deadline = engine.next_deadline()
+            if deadline is None or deadline > t:
+                return
+            step(SensorEvent(deadline, "tick", None))
+
+    for evt in events:
+        ticks_until(evt.t)
+        step(evt)
+    ticks_until(events[-1].t if until is None else t0 + until)
+    return actions, durations
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rejoue une trace capteurs dans le moteur d'intrusion.")
+    parser.add_argument("trace")
+    parser.add_argument("--speed", type=float, default=0.0, help="facteur d'accélération (0 = max)")
+    parser.add_argument("--until", type=float, help="durée simulée après le début de la trace (s)")
+    parser.add_argument("--expect", help="actions attendues (JSONL), code retour 1 si différent")
+    parser.add_argument("--repeat", type=int, default=1, help="nombre de rejeux (benchmark)")
+    parser.add_argument("--verbose", action="store_true", help="affiche le journal du moteur")
+    args = parser.parse_args()
+
+    events = load_trace(args.trace)
+    log = (lambda t, msg: print(f"[{t - events[0].t:8.3f}s] {msg}")) if args.verbose else None
+    durations = []
+    wall = time.perf_counter()
+    for _ in range(args.repeat):
+        actions, d = replay(events, speed=args.speed, until=args.until, log=log)
+        durations.extend(d)
+    wall = time.perf_counter() - wall
+
+    for t, kind, arg in actions:
+        print(json.dumps({"t": t, "action": kind, "arg": arg}))
+
+    if durations:
+        simulated = (events[-1].t - events[0].t if args.until is None else args.until) * args.repeat
+        print(f"# {len(durations)} appels moteur, p50 {percentile(durations, 50) * 1e6:.1f} µs, "
+              f"p99 {percentile(durations, 99) * 1e6:.1f} µs, max {max(durations) * 1e6:.1f} µs ; "
+              f"{simulated:.0f} s simulées en {wall:.3f} s (x{simulated / wall if wall else 0:.0f})",
+              file=sys.stderr)
+
+    if args.expect:
+        expected = [(d["t"], d["action"], d["arg"]) for d in map(json.loads, filter(str.strip, open(args.expect)))]
+        if expected != actions:
+            print("# ÉCHEC : actions différentes de " + args.expect, file=sys.stderr)
+            sys.exit(1)
+        print("# OK : actions conformes à " + args.expect, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
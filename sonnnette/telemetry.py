@@ -0,0 +1,124 @@
+# Télémétrie du client : durées des chemins chauds en mémoire fixe, résumé
+# périodique envoyé au serveur (/api/telemetry) et journal à niveaux bufferisé.
+#
+# Chaque durée observée tombe dans un seau d'un histogramme à bornes
+# logarithmiques fixes (0,1 ms à ~100 s) : coût constant, mémoire constante,
+# quel que soit le nombre d'observations. Les percentiles du résumé sont donc
+# approchés à la largeur d'un seau près (~ +26 %).
+
+import bisect
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+# Bornes supérieures des seaux en secondes : 10 par décade, de 0,1 ms à 100 s
+BOUNDS = tuple(1e-4 * 10 ** (i / 10) for i in range(61))
+
+
+class RollingHistogram:
+    """Histogramme d'une période : remis à zéro à chaque résumé."""
+
+    __slots__ = ("counts", "n", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BOUNDS) + 1)
+        self.reset()
+
+    def reset(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self.n = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BOUNDS, seconds)] += 1
+        self.n += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        rank = p / 100 * self.n
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(BOUNDS[i], self.max) if i < len(BOUNDS) else self.max
+        return self.max
+
+    def summary(self):
+        """{n, moyenne, p50, p95, p99, max} en millisecondes."""
+        ms = lambda s: round(s * 1000, 2)
+        return {"n": self.n, "mean": ms(self.total / self.n), "p50": ms(self.percentile(50)),
+                "p95": ms(self.percentile(95)), "p99": ms(self.percentile(99)), "max": ms(self.max)}
+
+
+class Telemetry:
+    """Registre des histogrammes (par nom) et des jauges lues au moment du résumé."""
+
+    def __init__(self, interval=300.0, clock=time.monotonic):
+        self.interval = interval
+        self.clock = clock
+        self._histograms = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+        self._period_start = clock()
+
+    def observe(self, name, seconds):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = RollingHistogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def gauge(self, name, read):
+        """`read()` est appelé à chaque résumé (cadence ADC mesurée, taille de file…)."""
+        self._gauges[name] = read
+
+    def due(self):
+        return self.clock() - self._period_start >= self.interval
+
+    def summary(self):
+        """Résumé de la période écoulée, puis remise à zéro des histogrammes."""
+        with self._lock:
+            now = self.clock()
+            timings = {name: h.summary() for name, h in self._histograms.items() if h.n}
+            for h in self._histograms.values():
+                h.reset()
+            period, self._period_start = now - self._period_start, now
+        gauges = {}
+        for name, read in self._gauges.items():
+            try:
+                gauges[name] = read()
+            except Exception:
+                gauges[name] = None
+        return {"period": round(period, 1), "timings": timings, "gauges": gauges}
+
+
+def setup_logging(level="INFO", name="sonnette"):
+    """Journal à niveaux : les appels ne font que mettre l'enregistrement en file,
+    le formatage (horodatage compris) et l'écriture se font dans le thread du
+    QueueListener. Renvoie (logger, listener) ; listener.stop() vide la file.
+    """
+    records = queue.SimpleQueue()
+    output = logging.StreamHandler()
+    output.setFormatter(logging.Formatter("[%(asctime)s] %(levelname).1s %(message)s", "%H:%M:%S"))
+    listener = logging.handlers.QueueListener(records, output)
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+    logger.addHandler(logging.handlers.QueueHandler(records))
+    logger.propagate = False
+    listener.start()
+    return logger, listener